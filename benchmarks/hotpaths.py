@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""Microbenchmarks of the per-message hot paths.
+
+Times each hot path, prints the results and optionally saves them as
+JSON. When given a baseline, it fails if any result regressed past the
+threshold, or if the baseline is missing.
+
+    python benchmarks/hotpaths.py --save results.json
+    python benchmarks/hotpaths.py --compare benchmarks/baseline.json
+"""
+import argparse
+import asyncio
+import json
+import platform
+import sys
+import timeit
+
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tzbot import TZBot, utils  # noqa: E402
+from tzbot.offsets import ZoneOffset  # noqa: E402
+from tzbot.poll import PopularityPoll  # noqa: E402
+from tzbot.stream import IRCConnection, StdioStream  # noqa: E402
+
+STDIO_COMMAND = "josh: !timeat America/Argentina/Buenos_Aires\n"
+STDIO_CHATTER = "josh: is anyone around to help me with the build?\n"
+IRC_COMMAND = b":josh!~josh@host.example.com PRIVMSG #tzbot :!timeat Vancouver"
+IRC_CHATTER = b":josh!~josh@host.example.com PRIVMSG #tzbot :is anyone around?"
+TIMEZONE = "America/Argentina/Buenos_Aires"
+
+
+def benchmarks() -> Dict[str, Callable[[], object]]:
+    stdio = StdioStream()
+    connection = IRCConnection("localhost", 6667, "tzbot")
+    poll = PopularityPoll()
+    bot = TZBot()
+    # Never used, the offset of the benchmarked timezone is cached
+    bot.poll, bot._session = poll, object()
+    bot.offsets.offsets["America/Vancouver"] = ZoneOffset(
+        timezone(-timedelta(hours=7)), datetime.now(timezone.utc) + timedelta(days=1)
+    )
+    tztime = datetime.now(timezone.utc)
+
+    return {
+        "stdio_parse_command": lambda: stdio._parse_command(STDIO_COMMAND),
+        "stdio_parse_chatter": lambda: stdio._parse_command(STDIO_CHATTER),
+        "irc_parse_command": lambda: connection._parse_command(IRC_COMMAND),
+        "irc_parse_chatter": lambda: connection._parse_command(IRC_CHATTER),
+        "is_valid_timezone": lambda: utils.is_valid_timezone(TIMEZONE),
+        "tz_prefixes": lambda: list(utils.tz_prefixes(TIMEZONE)),
+        "alias_lookup": lambda: bot.aliases.resolve("Vancouver"),
+        "alias_lookup_prefix": lambda: bot.aliases.resolve("new yo"),
+        "timeat_cmd_cached": _awaiting(lambda: bot._timeat_cmd("Vancouver")),
+        "increment_popularity_of": lambda: poll.increment_popularity_of(TIMEZONE),
+        "format_time": lambda: bot._format_time(tztime),
+    }
+
+
+def _awaiting(coroutine_func: Callable[[], object]) -> Callable[[], object]:
+    """Turns a coroutine function that never suspends into a plain one."""
+
+    def run():
+        coroutine = coroutine_func()
+        try:
+            coroutine.send(None)
+        except StopIteration as e:
+            return e.value
+        raise RuntimeError("benchmarked coroutine suspended")
+
+    return run
+
+
+def run_benchmarks(repeat: int) -> Dict[str, float]:
+    """Returns the best time per call of each benchmark, in nanoseconds."""
+
+    # Within a running event loop, as commands are answered
+    async def timed() -> Dict[str, float]:
+        results = {}
+        for name, func in benchmarks().items():
+            timer = timeit.Timer(func)
+            number, _ = timer.autorange()
+            best = min(timer.repeat(repeat=repeat, number=number))
+            results[name] = best / number * 1e9
+        return results
+
+    return asyncio.run(timed())
+
+
+def compare(results: Dict[str, float], baseline: Dict[str, float], threshold: float):
+    """Returns the names of the benchmarks that regressed past threshold."""
+    regressions = []
+    for name, elapsed in results.items():
+        if name in baseline and elapsed > baseline[name] * (1 + threshold):
+            regressions.append(name)
+    return regressions
+
+
+def parse_args(description: str) -> argparse.Namespace:
+    """Parses the command line options every benchmark takes."""
+    parser = argparse.ArgumentParser(
+        description=description, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--save", metavar="FILE", help="Saves the results as JSON")
+    parser.add_argument(
+        "--compare", metavar="FILE", help="Baseline JSON results to compare with"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Slowdown over the baseline considered a regression (default: 0.2)",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Timing repetitions (default: 5)"
+    )
+    return parser.parse_args()
+
+
+def load_baseline(filename: Optional[str]) -> Optional[Dict[str, float]]:
+    """Returns the results of a baseline, if any, or None if it's missing."""
+    if not filename:
+        return {}
+    if not Path(filename).exists():
+        # Passing unnoticed would let any regression through
+        print(f"Baseline {filename} not found. Record one with --save first")
+        return None
+    return json.loads(Path(filename).read_text())["results"]
+
+
+def report(
+    results: Dict[str, float],
+    baseline: Dict[str, float],
+    filename: Optional[str],
+    unit: str = "ns",
+    scale: float = 1,
+) -> None:
+    """Prints the results next to the baseline, and saves them to filename.
+
+    Results are in nanoseconds, and shown in unit once divided by scale.
+    """
+    for name, elapsed in results.items():
+        line = f"{name:<26} {elapsed / scale:>10.1f} {unit}"
+        if name in baseline:
+            line += f"  ({(elapsed / baseline[name] - 1) * 100:+.1f}%)"
+        print(line)
+
+    if filename:
+        Path(filename).write_text(
+            json.dumps(
+                {
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "results": results,
+                },
+                indent=2,
+            )
+        )
+
+
+def main() -> int:
+    args = parse_args(__doc__)
+    baseline = load_baseline(args.compare)
+    if baseline is None:
+        return 1
+
+    results = run_benchmarks(args.repeat)
+    report(results, baseline, args.save)
+
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"Regressions past {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
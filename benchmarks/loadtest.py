@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""End-to-end load test of the bot, without leaving localhost.
+
+Starts a fake IRC server and a stand-in for the time API, connects a
+real IRCConnection and TZBot to them, and sends commands at the target
+rate. Reports the commands answered per second, the latency of the
+replies and the peak RSS of the process.
+
+    python benchmarks/loadtest.py --rate 500 --commands 5000
+    python benchmarks/loadtest.py --api-latency 0.3 --api-error-rate 0.1
+    python benchmarks/loadtest.py --replay channel.log
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import resource
+import sys
+import tempfile
+import time
+
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List
+
+from aiohttp import web
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tzbot import TZBot, log, settings  # noqa: E402
+from tzbot.stream import IRCConnection, StdioStream  # noqa: E402
+
+CHANNEL = "#load"
+BOT_NICK = "tzbot"
+
+
+class TimeAPI:
+    """A stand-in for the time API with configurable latency and errors."""
+
+    def __init__(self, latency: float, error_rate: float) -> None:
+        self.latency, self.error_rate = latency, error_rate
+        self.requests = 0
+
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_get("/api/timezone", self.timezones)
+        app.router.add_get("/api/timezone/{timezone:.+}", self.timezone)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        return f"http://127.0.0.1:{port}/"
+
+    async def stop(self) -> None:
+        await self.runner.cleanup()
+
+    async def timezones(self, request: web.Request) -> web.Response:
+        return web.json_response(sorted(set(_aliases().values())))
+
+    async def timezone(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+
+        if random.random() < self.error_rate:
+            return web.Response(status=503)
+
+        offset = timedelta(hours=random.Random(request.path).randint(-12, 12))
+        now = datetime.now(timezone(offset))
+        return web.json_response(
+            {
+                "datetime": now.isoformat(),
+                "utc_offset": now.strftime("%z")[:3] + ":00",
+                "dst": False,
+                "dst_until": None,
+            }
+        )
+
+
+class IRCServer:
+    """A fake IRC server that sends commands and times the replies."""
+
+    def __init__(self, commands: List[str], rate: float) -> None:
+        self.commands, self.rate = commands, rate
+        self.sent_at: Dict[str, float] = {}
+        self.latencies: List[float] = []
+        self.joined = asyncio.Event()
+        self.done = asyncio.Event()
+        self.handler = None
+
+    async def start(self) -> int:
+        self.server = await asyncio.start_server(self.serve, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        self.server.close()
+        if self.handler:
+            # Closing the connection ends the handler
+            self.writer.close()
+            await asyncio.gather(self.handler, return_exceptions=True)
+
+    async def serve(self, reader, writer) -> None:
+        self.handler, self.writer = asyncio.current_task(), writer
+        receiving = asyncio.create_task(self.receive(reader))
+        await self.joined.wait()
+
+        # Send the commands in slices every tick to keep up with the rate
+        tick, started_at = 0.01, time.monotonic()
+        commands = iter(enumerate(self.commands))
+        while True:
+            due = int((time.monotonic() - started_at) * self.rate) + 1
+            batch = list(itertools.islice(commands, max(0, due - len(self.sent_at))))
+            if not batch or writer.is_closing():
+                break
+            now = time.monotonic()
+            for i, command in batch:
+                # Every command comes from a different nick to match replies
+                self.sent_at[f"u{i}"] = now
+                writer.write(f":u{i}!u@load PRIVMSG {CHANNEL} :{command}\r\n".encode())
+            await writer.drain()
+            await asyncio.sleep(tick)
+
+        await receiving
+
+    async def receive(self, reader) -> None:
+        while len(self.latencies) < len(self.commands):
+            line = await reader.readline()
+            if not line:
+                break
+            if line.startswith(b"JOIN"):
+                self.joined.set()
+            elif line.startswith(b"PRIVMSG"):
+                nick = line.split(b" :", 1)[1].split(b":", 1)[0].decode()
+                if nick in self.sent_at:
+                    self.latencies.append(time.monotonic() - self.sent_at[nick])
+        self.done.set()
+
+
+async def load_test(args: argparse.Namespace) -> Dict[str, float]:
+    commands = _commands(args)
+    api = TimeAPI(args.api_latency, args.api_error_rate)
+    irc_server = IRCServer(commands, args.rate)
+
+    settings.TIME_API = await api.start()
+    settings.TAG_USER = True
+    settings.IRC_SEND_RATE = settings.IRC_SEND_BURST = args.send_rate
+    settings.BACKOFF_INITIAL_WAIT = args.backoff
+    settings.POLL_FILENAME = str(Path(tempfile.mkdtemp()) / "poll")
+    if args.no_offset_cache:
+        settings.OFFSET_CACHE_TTL = 0
+    if args.no_response_cache:
+        settings.RESPONSE_CACHE_SIZE = 0
+
+    connection = IRCConnection("127.0.0.1", await irc_server.start(), BOT_NICK)
+    await connection.connect()
+    bot = TZBot(connection.join(CHANNEL))
+    running = asyncio.create_task(bot.run())
+
+    started_at = time.monotonic()
+    try:
+        await asyncio.wait_for(irc_server.done.wait(), args.timeout)
+    except asyncio.TimeoutError:
+        pass
+    elapsed = time.monotonic() - started_at
+
+    await irc_server.stop()
+    await connection.close()
+    await asyncio.gather(running, return_exceptions=True)
+    await api.stop()
+
+    latencies = sorted(irc_server.latencies)
+    return {
+        "commands_sent": len(irc_server.sent_at),
+        "replies": len(latencies),
+        "elapsed_s": elapsed,
+        "commands_per_s": len(latencies) / elapsed,
+        "p50_ms": _percentile(latencies, 50) * 1000,
+        "p95_ms": _percentile(latencies, 95) * 1000,
+        "p99_ms": _percentile(latencies, 99) * 1000,
+        "upstream_requests": api.requests,
+        # Kilobytes on Linux, bytes on macOS
+        "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def _commands(args: argparse.Namespace) -> List[str]:
+    if args.replay:
+        stream = StdioStream()
+        commands = []
+        with open(args.replay) as f:
+            for line in f:
+                command = stream._parse_command(line)
+                if command:
+                    commands.append(" ".join([command[1], *command[2]]))
+        return commands[: args.commands] if args.commands else commands
+
+    zones = sorted(set(_aliases().values()))[: args.zones]
+    return [f"!timeat {random.choice(zones)}" for _ in range(args.commands or 5000)]
+
+
+def _aliases() -> Dict[str, str]:
+    path = Path(__file__).resolve().parent.parent / "tzbot" / "aliases.json"
+    return json.loads(path.read_text())
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return float("nan")
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--rate", type=float, default=500, help="Commands per second")
+    parser.add_argument(
+        "--commands", type=int, help="Commands to send (default: 5000 synthetic)"
+    )
+    parser.add_argument(
+        "--zones", type=int, default=50, help="Distinct timezones in synthetic traffic"
+    )
+    parser.add_argument(
+        "--replay", metavar="FILE", help="Replays the commands of a `nick: msg` log"
+    )
+    parser.add_argument(
+        "--api-latency", type=float, default=0.05, help="Time API latency (seconds)"
+    )
+    parser.add_argument(
+        "--api-error-rate", type=float, default=0.0, help="Time API error ratio"
+    )
+    parser.add_argument(
+        "--send-rate",
+        type=float,
+        default=1e6,
+        help="Bot's IRC flood control rate. Unlimited by default to measure capacity",
+    )
+    parser.add_argument(
+        "--backoff", type=float, default=0.1, help="Initial retry wait (seconds)"
+    )
+    parser.add_argument(
+        "--no-offset-cache",
+        action="store_true",
+        help="Asks the time API for every command",
+    )
+    parser.add_argument(
+        "--no-response-cache",
+        action="store_true",
+        help="Formats an answer for every command",
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=120, help="Maximum test duration (seconds)"
+    )
+    args = parser.parse_args()
+
+    log.setup_logger("tzbot", level="WARNING")
+    results = asyncio.run(load_test(args))
+    for name, value in results.items():
+        print(f"{name:<18} {value:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
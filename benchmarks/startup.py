@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Startup time benchmark.
+
+Times `import tzbot` with `python -X importtime` and the whole of
+`tzbot --help`, each in a fresh interpreter. Fails if a module that is
+only needed once the bot talks to the network (e.g. aiohttp) is
+imported upfront and, when given a baseline, if any result regressed
+past the threshold or the baseline is missing.
+
+    python benchmarks/startup.py --save startup.json
+    python benchmarks/startup.py --compare benchmarks/startup_baseline.json
+"""
+import subprocess
+import sys
+import time
+
+from pathlib import Path
+from typing import Dict, List
+
+from hotpaths import compare, load_baseline, parse_args, report
+
+ROOT = Path(__file__).resolve().parent.parent
+DEFERRED_MODULES = ["aiohttp", "shelve"]
+
+
+def import_times(module: str) -> Dict[str, int]:
+    """Returns the cumulative import time of each module, in microseconds."""
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def help_time() -> float:
+    """Returns the seconds `tzbot --help` takes, interpreter included."""
+    started_at = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-m", "tzbot", "--help"],
+        cwd=ROOT,
+        stdout=subprocess.DEVNULL,
+        check=True,
+    )
+    return time.perf_counter() - started_at
+
+
+def run_benchmarks(repeat: int) -> Dict[str, float]:
+    """Returns the best time of each benchmark, in nanoseconds."""
+    imports = [import_times("tzbot")["tzbot"] for _ in range(repeat)]
+    helps = [help_time() for _ in range(repeat)]
+    return {"import_tzbot": min(imports) * 1e3, "tzbot_help": min(helps) * 1e9}
+
+
+def eager_imports() -> List[str]:
+    """Returns the deferred modules imported by `tzbot.__main__` anyway."""
+    times = import_times("tzbot.__main__")
+    return [module for module in DEFERRED_MODULES if module in times]
+
+
+def main() -> int:
+    args = parse_args(__doc__)
+    baseline = load_baseline(args.compare)
+    if baseline is None:
+        return 1
+
+    results = run_benchmarks(args.repeat)
+    report(results, baseline, args.save, unit="ms", scale=1e6)
+
+    status = 0
+    eager = eager_imports()
+    if eager:
+        print(f"Imported at startup: {', '.join(eager)}")
+        status = 1
+
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"Regressions past {args.threshold:.0%}: {', '.join(regressions)}")
+        status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,6 +2,17 @@ import pytest
 
 from aioresponses import aioresponses
 from datetime import datetime
+from tzbot import admission, cache, ratelimit, window
+from tzbot import api_client as api
+from tzbot.httpcache import HTTPCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
 
 
 @pytest.fixture
@@ -14,7 +25,26 @@ def formatted_tztime(tztime) -> datetime:
     return tztime.strftime("%-d %b %Y %H:%M") + "\n"
 
 
+@pytest.fixture
+def clock(monkeypatch):
+    """Stands in for the time of every module keeping track of it."""
+    clock = Clock()
+    for module in (admission, api, cache, ratelimit, window):
+        monkeypatch.setattr(module, "time", clock)
+    return clock
+
+
 @pytest.fixture
 def response():
     with aioresponses() as m:
         yield m
+
+
+@pytest.fixture(autouse=True)
+def closed_circuit(monkeypatch):
+    monkeypatch.setattr(api, "circuit", api.CircuitBreaker())
+
+
+@pytest.fixture(autouse=True)
+def empty_http_cache(monkeypatch):
+    monkeypatch.setattr(api, "http_cache", HTTPCache())
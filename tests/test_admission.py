@@ -0,0 +1,34 @@
+from tzbot.admission import AdmissionControl
+
+
+def test_should_limit_commands_per_nick(clock):
+    control = AdmissionControl(rate=1, burst=2)
+
+    assert control.admit("josh", "!timeat", ["Tokyo"]) is None
+    assert control.admit("josh", "!timeat", ["Lima"]) is None
+    assert "rate_limited" == control.admit("josh", "!timeat", ["Oslo"])
+    # Other nicks have their own share
+    assert control.admit("mary", "!timeat", ["Oslo"]) is None
+
+    clock.now += 1
+    assert control.admit("josh", "!timeat", ["Oslo"]) is None
+
+
+def test_should_drop_repeated_commands_within_the_window(clock):
+    control = AdmissionControl(rate=10, burst=10, duplicate_window=5)
+
+    assert control.admit("josh", "!timeat", ["Tokyo"]) is None
+    assert "duplicate" == control.admit("josh", "!timeat", ["Tokyo"])
+    assert control.admit("mary", "!timeat", ["Tokyo"]) is None
+
+    clock.now += 5
+    assert control.admit("josh", "!timeat", ["Tokyo"]) is None
+
+
+def test_should_keep_track_of_the_last_nicks_only(clock):
+    control = AdmissionControl(rate=1, burst=1, max_nicks=2)
+
+    for nick in ["josh", "mary", "ann"]:
+        control.admit(nick, "!timeat", ["Tokyo"])
+
+    assert ["mary", "ann"] == list(control.nicks)
@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+from tzbot.aliases import AliasIndex, build_index
+
+ALIASES = {
+    "Vancouver": "America/Vancouver",
+    "New_York": "America/New_York",
+    "New_Salem": "America/North_Dakota/New_Salem",
+    "EST": "EST",
+}
+
+
+@pytest.mark.parametrize(
+    "name, timezone",
+    [
+        ("Vancouver", "America/Vancouver"),
+        ("vancouver", "America/Vancouver"),
+        ("new york", "America/New_York"),
+        ("New_York", "America/New_York"),
+        ("america/new_york", "America/New_York"),
+        ("EST", "EST"),
+        ("Vanc", "America/Vancouver"),
+        ("america/nor", "America/North_Dakota/New_Salem"),
+    ],
+)
+def test_should_resolve_names(index, name, timezone):
+    assert timezone == index.resolve(name)
+
+
+@pytest.mark.parametrize("name", ["", "Somewhere", "New", "va", "america/"])
+def test_should_not_resolve_unknown_or_ambiguous_names(index, name):
+    assert index.resolve(name) is None
+
+
+def test_should_load_lazily(tmp_path):
+    index = AliasIndex(str(tmp_path / "index.json"))
+    (tmp_path / "index.json").write_text(json.dumps(build_index(ALIASES)))
+    assert not index.loaded
+
+    assert "EST" == index.resolve("est")
+    assert index.loaded
+
+
+def test_should_resolve_nothing_without_index(tmp_path):
+    assert AliasIndex(str(tmp_path / "missing.json")).resolve("EST") is None
+
+
+def test_should_reject_conflicting_aliases():
+    with pytest.raises(RuntimeError):
+        build_index({"Est": "America/New_York", "EST": "EST"})
+
+
+@pytest.fixture
+def index(tmp_path):
+    (tmp_path / "index.json").write_text(json.dumps(build_index(ALIASES)))
+    return AliasIndex(str(tmp_path / "index.json"))
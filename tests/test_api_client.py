@@ -1,10 +1,12 @@
 import aiohttp
+import asyncio
 import pytest
 
 from aiohttp import ClientSession
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from tzbot import api_client as api
 from tzbot import settings
+from tzbot.offsets import OffsetCache
 from urllib.parse import urljoin
 
 
@@ -119,6 +121,240 @@ async def test_should_return_timezones(response):
     assert timezones == result
 
 
+@pytest.mark.asyncio
+async def test_should_share_concurrent_requests_for_same_timezone(response, tztime):
+    url = urljoin(settings.TIME_API, "/api/timezone/somewhere")
+    response.get(url, payload={"datetime": tztime.isoformat()}, repeat=True)
+    coalesced = api.time_at_calls.coalesced
+
+    async with ClientSession() as session:
+        results = await asyncio.gather(
+            *[api.get_time_at("somewhere", session) for _ in range(3)]
+        )
+
+    _, requests = response.requests.popitem()
+    assert len(requests) == 1
+    assert results == [tztime] * 3
+    assert api.time_at_calls.coalesced - coalesced == 2
+
+
+@pytest.mark.asyncio
+async def test_should_share_errors_among_concurrent_requests(response):
+    url = urljoin(settings.TIME_API, "/api/timezone/somewhere")
+    response.get(url, status=401, repeat=True)
+
+    async with ClientSession() as session:
+        results = await asyncio.gather(
+            *[api.get_time_at("somewhere", session) for _ in range(2)],
+            return_exceptions=True,
+        )
+
+    _, requests = response.requests.popitem()
+    assert len(requests) == settings.BACKOFF_MAX_RETRIES
+    assert all(isinstance(r, api.APIError) for r in results)
+
+
+@pytest.mark.asyncio
+async def test_should_compute_time_locally_while_offset_is_valid(response, tztime):
+    url = urljoin(settings.TIME_API, "/api/timezone/somewhere")
+    dst_until = datetime.now(timezone.utc) + timedelta(days=1)
+    payload = {
+        "datetime": tztime.isoformat(),
+        "utc_offset": "-05:30",
+        "dst_until": dst_until.isoformat(),
+    }
+    response.get(url, payload=payload, repeat=True)
+    offsets = OffsetCache()
+
+    async with ClientSession() as session:
+        await api.get_time_at("somewhere", session, offsets)
+        result = await api.get_time_at("somewhere", session, offsets)
+
+    _, requests = response.requests.popitem()
+    assert len(requests) == 1
+    assert result.utcoffset() == -timedelta(hours=5, minutes=30)
+
+
+@pytest.mark.asyncio
+async def test_should_request_time_again_after_dst_transition(response, tztime):
+    url = urljoin(settings.TIME_API, "/api/timezone/somewhere")
+    dst_until = datetime.now(timezone.utc) - timedelta(seconds=1)
+    payload = {
+        "datetime": tztime.isoformat(),
+        "utc_offset": "+01:00",
+        "dst_until": dst_until.isoformat(),
+    }
+    response.get(url, payload=payload, repeat=True)
+    offsets = OffsetCache()
+
+    async with ClientSession() as session:
+        await api.get_time_at("somewhere", session, offsets)
+        await api.get_time_at("somewhere", session, offsets)
+
+    _, requests = response.requests.popitem()
+    assert len(requests) == 2
+
+
+def test_should_expire_offset_when_dst_starts(monkeypatch):
+    # DST starts at 2:00 in Chicago, on 2026-03-08
+    dst_start = datetime(2026, 3, 8, 8, tzinfo=timezone.utc)
+    before = dst_start - timedelta(minutes=5)
+    monkeypatch.setattr("tzbot.offsets._utcnow", lambda: before)
+    cache = OffsetCache(ttl=3600)
+
+    cache.update("America/Chicago", {"utc_offset": "-06:00", "dst_until": None})
+
+    valid_until = cache.offsets["America/Chicago"].valid_until
+    assert dst_start - timedelta(seconds=1) <= valid_until <= dst_start
+
+
+@pytest.mark.asyncio
+async def test_should_use_timezone_database_when_api_is_unreachable(response):
+    url = urljoin(settings.TIME_API, "/api/timezone/Europe/London")
+    response.get(url, exception=aiohttp.ServerTimeoutError, repeat=True)
+
+    async with ClientSession() as session:
+        result = await api.get_time_at("Europe/London", session, OffsetCache())
+
+    assert str(result.tzinfo) == "Europe/London"
+
+
+@pytest.mark.asyncio
+async def test_should_not_fall_back_when_timezone_is_unknown(response):
+    url = urljoin(settings.TIME_API, "/api/timezone/Europe/London")
+    response.get(url, status=404, repeat=True)
+
+    with pytest.raises(api.UnknownTimezoneError, match="unknown timezone"):
+        async with ClientSession() as session:
+            await api.get_time_at("Europe/London", session, OffsetCache())
+
+
+@pytest.mark.asyncio
+async def test_should_look_up_each_distinct_timezone_once(response, tztime):
+    response.get(
+        urljoin(settings.TIME_API, "/api/timezone/Europe/London"),
+        payload={"datetime": tztime.isoformat()},
+        repeat=True,
+    )
+    response.get(urljoin(settings.TIME_API, "/api/timezone/Nowhere"), status=404)
+
+    async with ClientSession() as session:
+        results = await api.get_times_at(
+            ["Europe/London", "Nowhere", "Europe/London", "!!"], session
+        )
+
+    assert ["Europe/London", "Nowhere", "!!"] == list(results)
+    assert tztime == results["Europe/London"]
+    assert isinstance(results["Nowhere"], api.UnknownTimezoneError)
+    assert isinstance(results["!!"], api.UnknownTimezoneError)
+    assert 2 == sum(len(requests) for requests in response.requests.values())
+
+
+@pytest.mark.asyncio
+async def test_should_not_retry_past_the_deadline(response, monkeypatch):
+    monkeypatch.setattr(settings, "BACKOFF_INITIAL_WAIT", 1)
+    url = urljoin(settings.TIME_API, "/api/timezone/somewhere")
+    response.get(url, status=503, repeat=True)
+    loop = asyncio.get_running_loop()
+
+    with pytest.raises(api.APIError, match="http code: 503"):
+        async with ClientSession() as session:
+            await api.get_time_at("somewhere", session, deadline=loop.time() + 0.5)
+
+    _, requests = response.requests.popitem()
+    assert len(requests) == 1
+
+
+@pytest.mark.asyncio
+async def test_should_not_call_api_past_the_deadline(response):
+    loop = asyncio.get_running_loop()
+
+    with pytest.raises(api.APIError, match="deadline exceeded"):
+        async with ClientSession() as session:
+            await api.get_time_at("somewhere", session, deadline=loop.time() - 1)
+
+    assert not response.requests
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("slow", [True, False])
+async def test_should_hedge_requests_to_the_mirror(response, monkeypatch, tztime, slow):
+    async def hang(url, **kwargs):
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(settings, "TIME_API_MIRROR", "http://mirror.example.com/")
+    monkeypatch.setattr(settings, "API_HEDGE_DELAY", 0.01)
+    url = urljoin(settings.TIME_API, "/api/timezone/somewhere")
+    if slow:
+        response.get(url, callback=hang)
+    else:
+        response.get(url, status=503)
+    response.get(
+        "http://mirror.example.com/api/timezone/somewhere",
+        payload={"datetime": tztime.isoformat()},
+    )
+
+    async with ClientSession() as session:
+        result = await asyncio.wait_for(api.get_time_at("somewhere", session), 1)
+
+    assert tztime == result
+
+
+@pytest.mark.asyncio
+async def test_should_not_wait_for_the_mirror_past_the_deadline(response, monkeypatch):
+    async def hang(url, **kwargs):
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(settings, "TIME_API_MIRROR", "http://mirror.example.com/")
+    monkeypatch.setattr(settings, "API_HEDGE_DELAY", 0.1)
+    response.get(urljoin(settings.TIME_API, "/api/timezone/somewhere"), callback=hang)
+    response.get("http://mirror.example.com/api/timezone/somewhere", callback=hang)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + 0.2
+
+    with pytest.raises(api.APIError):
+        async with ClientSession() as session:
+            await api.get_time_at("somewhere", session, deadline=deadline)
+
+    assert loop.time() < deadline + 0.05
+
+
+@pytest.mark.asyncio
+async def test_should_fail_fast_while_circuit_is_open(response, monkeypatch):
+    monkeypatch.setattr(api, "circuit", api.CircuitBreaker(max_failures=2))
+    url = urljoin(settings.TIME_API, "/api/timezone/Europe/London")
+    response.get(url, status=503, repeat=True)
+
+    async with ClientSession() as session:
+        result = await api.get_time_at("Europe/London", session, OffsetCache())
+        with pytest.raises(api.CircuitOpenError):
+            await api.get_time_at("Europe/London", session)
+
+    assert str(result.tzinfo) == "Europe/London"
+    _, requests = response.requests.popitem()
+    assert len(requests) == 2
+
+
+def test_should_let_a_trial_call_through_once_circuit_resets(clock):
+    circuit = api.CircuitBreaker(max_failures=2, reset_after=30)
+
+    circuit.record(False)
+    assert circuit.allow()
+    circuit.record(False)
+    assert not circuit.allow()
+
+    clock.now += 30
+    assert circuit.allow()
+    assert not circuit.allow()
+    circuit.record(False)
+    assert not circuit.allow()
+
+    clock.now += 30
+    assert circuit.allow()
+    circuit.record(True)
+    assert circuit.allow() and circuit.allow()
+
+
 @pytest.fixture(autouse=True)
 def no_wait_between_retries(monkeypatch):
     monkeypatch.setattr(settings, "BACKOFF_INITIAL_WAIT", 0)
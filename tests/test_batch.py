@@ -0,0 +1,62 @@
+import pytest
+
+from tzbot import settings
+from tzbot import TZBot
+from tzbot.batch import BatchRunner
+from tzbot.stream import StdioStream
+
+
+@pytest.mark.asyncio
+async def test_should_write_answers_in_input_order(
+    mocker, tztime, formatted_tztime, tmp_path
+):
+    mocker.patch("tzbot.api_client.get_time_at", return_value=tztime)
+    stream = await open_stream(
+        tmp_path,
+        [
+            "josh: !timeat America/Chicago",
+            "josh: hello",
+            "mary: !timepopularity America",
+            "josh: !timeat Vancouver",
+        ],
+    )
+
+    await BatchRunner(TZBot(), stream, concurrency=2).run()
+    await stream.close()
+
+    assert [formatted_tztime, "1\n", formatted_tztime] == read_output(stream)
+
+
+@pytest.mark.asyncio
+async def test_should_share_answers_of_identical_commands(mocker, tztime, tmp_path):
+    mock = mocker.patch("tzbot.api_client.get_time_at", return_value=tztime)
+    stream = await open_stream(tmp_path, ["josh: !timeat America/Chicago"] * 5)
+    runner = BatchRunner(TZBot(), stream, dedup_window=60)
+
+    await runner.run()
+    await stream.close()
+
+    assert 5 == len(read_output(stream))
+    assert 1 == mock.call_count
+    assert 4 == runner.deduplicated
+    # Every command is counted, even if answered once
+    assert 5 == runner.bot.poll.get_popularity_of("America/Chicago")
+
+
+async def open_stream(tmp_path, lines):
+    (tmp_path / "input").write_text("".join(line + "\n" for line in lines))
+    stream = StdioStream(open(tmp_path / "input"), open(tmp_path / "output", "w"))
+    await stream.connect()
+    return stream
+
+
+def read_output(stream):
+    stream.istream.close()
+    stream.ostream.close()
+    with open(stream.ostream.name) as f:
+        return f.readlines()
+
+
+@pytest.fixture(autouse=True)
+def change_poll_file(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "POLL_FILENAME", str(tmp_path / "poll"))
@@ -0,0 +1,35 @@
+from datetime import datetime
+from tzbot.cache import ResponseCache
+
+
+def test_should_expire_answers_when_the_minute_ends(clock):
+    responses = ResponseCache()
+    tztime = datetime(2021, 5, 15, 22, 54, 45)
+    responses.put("Europe/London", "15 May 2021 22:54", tztime)
+
+    clock.now += 14.9
+    assert "15 May 2021 22:54" == responses.get("Europe/London")
+
+    clock.now += 0.1
+    assert responses.get("Europe/London") is None
+    assert (1, 1) == (responses.hits, responses.misses)
+
+
+def test_should_evict_least_recently_used_answers(clock):
+    responses = ResponseCache(size=2)
+    tztime = datetime(2021, 5, 15, 22, 54)
+    responses.put("Europe/London", "London", tztime)
+    responses.put("Europe/Paris", "Paris", tztime)
+    responses.get("Europe/London")
+    responses.put("Europe/Rome", "Rome", tztime)
+
+    assert "London" == responses.get("Europe/London")
+    assert responses.get("Europe/Paris") is None
+    assert "Rome" == responses.get("Europe/Rome")
+
+
+def test_should_cache_nothing_when_size_is_zero(clock):
+    responses = ResponseCache(size=0)
+    responses.put("Europe/London", "London", datetime(2021, 5, 15, 22, 54))
+
+    assert responses.get("Europe/London") is None
@@ -0,0 +1,90 @@
+import pytest
+
+from aiohttp import ClientSession
+from tzbot import api_client as api
+from tzbot import settings
+from tzbot.httpcache import HTTPCache
+from urllib.parse import urljoin
+
+TIMEZONES = ["Asia/Tokyo", "Europe/London"]
+URL = urljoin(settings.TIME_API, "/api/timezone")
+
+
+@pytest.mark.asyncio
+async def test_should_use_fresh_responses_without_requests(response):
+    headers = {"Cache-Control": "max-age=60"}
+    response.get(URL, payload=TIMEZONES, headers=headers)
+
+    async with ClientSession() as session:
+        assert TIMEZONES == await api.get_timezones(session)
+        assert TIMEZONES == await api.get_timezones(session)
+
+    _, requests = response.requests.popitem()
+    assert len(requests) == 1
+
+
+@pytest.mark.asyncio
+async def test_should_revalidate_stale_responses(response):
+    headers = {
+        "Cache-Control": "no-cache",
+        "ETag": '"v1"',
+        "Last-Modified": "Sat, 15 May 2021 22:54:27 GMT",
+    }
+    response.get(URL, payload=TIMEZONES, headers=headers)
+    response.get(URL, status=304)
+
+    async with ClientSession() as session:
+        assert TIMEZONES == await api.get_timezones(session)
+        assert TIMEZONES == await api.get_timezones(session)
+
+    _, requests = response.requests.popitem()
+    assert {} == requests[0].kwargs["headers"]
+    assert {
+        "If-None-Match": '"v1"',
+        "If-Modified-Since": "Sat, 15 May 2021 22:54:27 GMT",
+    } == requests[1].kwargs["headers"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "headers",
+    [
+        {},
+        {"Cache-Control": "no-store", "ETag": '"v1"'},
+        {"Age": "60", "Cache-Control": "max-age=60"},
+    ],
+)
+async def test_should_not_keep_responses_that_cannot_be_reused(response, headers):
+    response.get(URL, payload=TIMEZONES, headers=headers)
+
+    async with ClientSession() as session:
+        await api.get_timezones(session)
+
+    assert {} == api.http_cache.responses
+
+
+@pytest.mark.asyncio
+async def test_should_keep_responses_on_disk(response, tmp_path):
+    filename = str(tmp_path / "http_cache.json")
+    headers = {"Expires": "Fri, 01 Jan 2100 00:00:00 GMT"}
+    response.get(URL, payload=TIMEZONES, headers=headers)
+
+    cache = HTTPCache(filename)
+    await cache.open()
+    async with ClientSession() as session:
+        api.http_cache = cache
+        await api.get_timezones(session)
+    await cache.close()
+
+    cache = HTTPCache(filename)
+    await cache.open()
+    assert TIMEZONES == cache.fresh(URL)
+
+
+def test_should_evict_least_recently_used_responses():
+    cache = HTTPCache(size=2)
+    for url in ["a", "b", "c"]:
+        cache.store(url, {"Cache-Control": "max-age=60"}, url)
+
+    assert cache.fresh("a") is None
+    assert "c" == cache.fresh("c")
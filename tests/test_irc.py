@@ -0,0 +1,39 @@
+from tzbot import irc
+
+
+def test_should_parse_every_part_of_a_message():
+    line = rb"@id=123;msg=a\sb\:c;flag :nick!user@host PRIVMSG #chan :hello there "
+    message = irc.parse_message(line)
+
+    assert "PRIVMSG" == message.command
+    assert ["#chan", "hello there "] == message.params
+    assert "nick!user@host" == message.prefix
+    assert "nick" == message.nick
+    assert {"id": "123", "msg": "a b;c", "flag": ""} == message.tags
+
+
+def test_should_parse_messages_without_prefix_or_trailing():
+    message = irc.parse_message(b"ping server1 server2")
+
+    assert "PING" == message.command
+    assert ["server1", "server2"] == message.params
+    assert message.prefix is None and message.nick is None
+    assert {} == message.tags
+
+
+def test_should_not_have_nick_when_sent_by_a_server():
+    message = irc.parse_message(b":irc.server.net 001 tzbot :Welcome")
+    assert message.nick is None
+
+
+def test_should_reject_malformed_messages():
+    assert irc.parse_message(b"") is None
+    assert irc.parse_message(b":prefix-only") is None
+
+
+def test_should_parse_bot_commands():
+    assert ("!timeat", ["A/B"]) == irc.parse_bot_command("  !timeat A/B")
+    assert ("!timepopularity", ["A"]) == irc.parse_bot_command("!timepopularity A")
+    assert irc.parse_bot_command("!timeat") is None
+    assert irc.parse_bot_command("!timezone A") is None
+    assert irc.parse_bot_command("hello") is None
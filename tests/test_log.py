@@ -0,0 +1,65 @@
+import json
+import logging
+
+import pytest
+
+from tzbot import log
+
+
+def test_should_write_logs_from_the_listener_thread(capsys):
+    logger = log.setup_logger("tzbot", level="INFO", json_output=False)
+    logger.info("Command received from '%s'", "josh")
+    logger.debug("Not shown")
+    log.shutdown()
+
+    lines = capsys.readouterr().err.splitlines()
+    assert 1 == len(lines)
+    assert lines[0].endswith("[INFO -- tzbot]: Command received from 'josh'")
+
+
+def test_should_write_logs_as_json(capsys):
+    logger = log.setup_logger("tzbot", level="INFO", json_output=True)
+    try:
+        raise ValueError("malformed")
+    except ValueError:
+        logger.exception("Couldn't parse %s", "!timeat")
+    log.shutdown()
+
+    entry = json.loads(capsys.readouterr().err)
+    assert "ERROR" == entry["level"]
+    assert "Couldn't parse !timeat" == entry["message"]
+    assert "ValueError: malformed" in entry["exception"]
+
+
+def test_should_sample_logs_per_category(capsys):
+    log.setup_logger(
+        "tzbot", level="INFO", json_output=False, sample_rates={"commands": 0}
+    )
+    logging.getLogger("tzbot.commands").info("Command received")
+    logging.getLogger("tzbot.irc").info("IRC: PONG")
+    log.shutdown()
+
+    assert ["IRC: PONG"] == [
+        line.split("]: ", 1)[1] for line in capsys.readouterr().err.splitlines()
+    ]
+
+
+def test_should_show_the_caller_once_set_up_again_for_debug(capsys):
+    log.setup_logger("tzbot", level="INFO", json_output=False)
+    logger = log.setup_logger("tzbot", level="DEBUG", json_output=False)
+    logger.debug("Shown")
+    log.shutdown()
+
+    assert "test_log.py(" in capsys.readouterr().err
+
+
+@pytest.fixture(autouse=True)
+def restore_logging():
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    yield
+    log.shutdown()
+    root.handlers[:], root.level = handlers, level
+    for name in ["tzbot.commands", "tzbot.irc"]:
+        logging.getLogger(name).filters.clear()
+        logging.getLogger(name).setLevel(logging.NOTSET)
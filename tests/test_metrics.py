@@ -0,0 +1,72 @@
+import aiohttp
+import pytest
+
+from tzbot import metrics
+
+
+def test_should_render_counters_per_label():
+    counter = metrics.Counter("test_total", "A counter", ["command"])
+    counter.inc(command="!timeat")
+    counter.inc(2, command="!timeat")
+    counter.inc(command="!timepopularity")
+
+    assert [
+        "# HELP test_total A counter",
+        "# TYPE test_total counter",
+        'test_total{command="!timeat"} 3',
+        'test_total{command="!timepopularity"} 1',
+    ] == counter.render()
+
+
+def test_should_render_cumulative_histogram_buckets():
+    histogram = metrics.Histogram("test_seconds", "A histogram", buckets=[0.1, 1])
+    histogram.observe(0.05)
+    histogram.observe(0.1)
+    histogram.observe(0.5)
+    histogram.observe(5)
+
+    assert [
+        "# HELP test_seconds A histogram",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{le="0.1"} 2',
+        'test_seconds_bucket{le="1"} 3',
+        'test_seconds_bucket{le="+Inf"} 4',
+        "test_seconds_sum 5.65",
+        "test_seconds_count 4",
+    ] == histogram.render()
+
+
+def test_should_read_gauges_when_rendered():
+    values = [1]
+    gauge = metrics.Gauge("test_gauge", "A gauge")
+    assert [] == gauge.render()
+
+    gauge.set_function(lambda: values[-1])
+    values.append(7)
+    assert "test_gauge 7" == gauge.render()[-1]
+
+
+def test_should_escape_label_values():
+    counter = metrics.Counter("test_escaped_total", "A counter", ["error"])
+    counter.inc(error='Status "503"\n')
+
+    assert 'test_escaped_total{error="Status \\"503\\"\\n"} 1' == counter.render()[-1]
+
+
+@pytest.mark.asyncio
+async def test_should_serve_metrics_over_http(unused_tcp_port):
+    metrics.COMMANDS_IGNORED.inc()
+    runner = await metrics.serve("127.0.0.1", unused_tcp_port)
+
+    try:
+        async with aiohttp.ClientSession() as session:
+            url = f"http://127.0.0.1:{unused_tcp_port}/metrics"
+            async with session.get(url) as response:
+                assert 200 == response.status
+                assert response.content_type == "text/plain"
+                body = await response.text()
+    finally:
+        await runner.cleanup()
+
+    assert "# TYPE tzbot_commands_ignored_total counter" in body
+    assert "tzbot_commands_ignored_total " in body
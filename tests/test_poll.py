@@ -0,0 +1,114 @@
+import pytest
+
+from tzbot.poll import PopularityPoll
+
+
+@pytest.mark.asyncio
+async def test_should_count_requests_per_prefix(filename):
+    poll = PopularityPoll(filename)
+    poll.increment_popularity_of("America/Argentina/Buenos_Aires")
+    poll.increment_popularity_of("America/Chicago")
+
+    assert 2 == poll.get_popularity_of("America")
+    assert 1 == poll.get_popularity_of("America/Argentina")
+    assert 1 == poll.get_popularity_of("America/Chicago")
+    assert 0 == poll.get_popularity_of("America/Argentina/Cordoba")
+    assert 0 == poll.get_popularity_of("Europe")
+
+
+@pytest.mark.asyncio
+async def test_should_persist_counts_when_closed(filename):
+    poll = await open_poll(filename)
+    poll.increment_popularity_of("America/Chicago")
+    await poll.close()
+
+    poll = await open_poll(filename)
+    poll.increment_popularity_of("America/Chicago")
+    await poll.close()
+
+    assert 2 == poll.get_popularity_of("America/Chicago")
+    assert {} == poll.pending
+
+
+@pytest.mark.asyncio
+async def test_should_add_increments_to_counts_written_by_others(filename):
+    poll, other = await open_poll(filename), await open_poll(filename)
+    other.increment_popularity_of("Etc/GMT+10")
+    await other.close()
+    poll.increment_popularity_of("Etc/GMT+10")
+    await poll.close()
+
+    poll = await open_poll(filename)
+    await poll.close()
+
+    assert 2 == poll.get_popularity_of("Etc")
+
+
+@pytest.mark.asyncio
+async def test_should_rank_the_most_requested_timezones_per_prefix(filename):
+    poll = PopularityPoll(filename)
+    for timezone in ["America/Chicago", "Etc/GMT+10", "America/Argentina/Salta"]:
+        poll.increment_popularity_of(timezone)
+    for _ in range(2):
+        poll.increment_popularity_of("America/Argentina/Cordoba")
+
+    assert [
+        ("America/Argentina/Cordoba", 2),
+        ("America/Argentina/Salta", 1),
+    ] == poll.get_top_of("America", 2)
+    assert [("America/Argentina/Cordoba", 2), ("America/Argentina/Salta", 1)] == (
+        poll.get_top_of("America/Argentina", 5)
+    )
+    assert [] == poll.get_top_of("Europe", 5)
+
+
+@pytest.mark.asyncio
+async def test_should_keep_rankings_sorted_as_counts_change(filename):
+    poll = PopularityPoll(filename)
+    timezones = ["Etc/GMT+1", "Etc/GMT+2", "Etc/GMT+3"]
+    for timezone in [0, 1, 1, 2, 2, 2, 0, 0, 0, 1, 1]:
+        poll.increment_popularity_of(timezones[timezone])
+
+    assert [("Etc/GMT+1", 4), ("Etc/GMT+2", 4), ("Etc/GMT+3", 3)] == poll.get_top_of(
+        "Etc", 5
+    )
+
+
+@pytest.mark.asyncio
+async def test_should_keep_ranking_counts_written_by_others(filename):
+    other = await open_poll(filename)
+    for _ in range(3):
+        other.increment_popularity_of("America/Chicago")
+    await other.close()
+
+    poll = await open_poll(filename)
+    poll.increment_popularity_of("America/Lima")
+    await poll.close()
+
+    assert [("America/Chicago", 3), ("America/Lima", 1)] == poll.get_top_of(
+        "America", 5
+    )
+
+
+@pytest.mark.asyncio
+async def test_should_count_requests_within_windows(filename, clock):
+    poll = PopularityPoll(filename)
+    poll.increment_popularity_of("America/Chicago")
+    clock.now += 7200
+    poll.increment_popularity_of("America/Lima")
+
+    assert 1 == poll.get_popularity_of("America", "hour")
+    assert 2 == poll.get_popularity_of("America", "day")
+    assert 0 == poll.get_popularity_of("America/Chicago", "hour")
+    assert 0 == poll.get_popularity_of("Europe", "hour")
+
+
+async def open_poll(filename):
+    poll = PopularityPoll(filename)
+    await poll.open()
+    return poll
+
+
+@pytest.fixture
+def filename(tmp_path):
+    return str(tmp_path / "poll")
@@ -0,0 +1,100 @@
+import shelve
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pytest
+
+from tzbot.pollstore import PollStore
+
+
+def test_should_merge_the_segments_of_every_store(filename):
+    store, other = PollStore(filename), PollStore(filename)
+    store.append({"America/Chicago": 1})
+    other.append({"America/Chicago": 2, "Etc/GMT+10": 1})
+
+    assert {"America/Chicago": 3, "Etc/GMT+10": 1} == store.compact()
+    # Already merged records aren't counted again
+    assert {"America/Chicago": 3, "Etc/GMT+10": 1} == other.compact()
+
+
+def test_should_leave_incomplete_records_for_later(filename):
+    store = PollStore(filename)
+    with open(store.segment, "ab") as f:
+        f.write(b"1\tAmerica/Chicago\n2\tEtc/GM")
+
+    assert {"America/Chicago": 1} == store.compact()
+
+    with open(store.segment, "ab") as f:
+        f.write(b"T+10\n")
+    assert {"America/Chicago": 1, "Etc/GMT+10": 2} == store.compact()
+
+
+def test_should_remove_the_segment_when_closing(filename):
+    store = PollStore(filename)
+    store.append({"America/Chicago": 1})
+    store.compact(close=True)
+
+    assert not Path(store.segment).exists()
+    assert {"America/Chicago": 1} == PollStore(filename).compact()
+
+
+def test_should_start_a_new_segment_once_merged_past_its_size(filename):
+    store = PollStore(filename, segment_size=30)
+    store.append({"America/Chicago": 1, "Etc/GMT+10": 1})
+    first = store.segment
+
+    assert {"America/Chicago": 1, "Etc/GMT+10": 1} == store.compact()
+    assert not Path(first).exists()
+
+    store.append({"America/Chicago": 1})
+    assert {"America/Chicago": 2, "Etc/GMT+10": 1} == store.compact()
+    assert Path(store.segment).exists()
+
+
+@pytest.mark.parametrize("snapshot", [b"", b"garbage\n1\tEtc/GMT+10\n"])
+def test_should_ignore_an_unreadable_snapshot(filename, snapshot):
+    Path(f"{filename}.snapshot").write_bytes(snapshot)
+    store = PollStore(filename)
+    store.append({"America/Chicago": 1})
+
+    assert {"America/Chicago": 1} == store.compact()
+
+
+def test_should_skip_malformed_snapshot_records(filename):
+    Path(f"{filename}.snapshot").write_bytes(b"{}\n1\tEtc/GMT+10\ngarbage\n")
+
+    assert {"Etc/GMT+10": 1} == PollStore(filename).compact()
+
+
+def test_should_count_increments_from_several_processes(filename):
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        list(executor.map(increment_many_times, [filename] * 4))
+
+    assert {"America/Chicago": 200} == PollStore(filename).compact()
+    assert [] == list(Path(filename).parent.glob("*.segment"))
+
+
+def test_should_migrate_counts_kept_per_prefix(filename):
+    with shelve.open(filename) as poll:
+        poll.update({"America": 3, "America/Chicago": 2, "America/Argentina": 1})
+        poll.update({"America/Argentina/Cordoba": 1, "Etc": 1, "Etc/GMT+10": 1})
+
+    assert {
+        "America/Chicago": 2,
+        "America/Argentina/Cordoba": 1,
+        "Etc/GMT+10": 1,
+    } == PollStore(filename).compact()
+
+
+def increment_many_times(filename):
+    store = PollStore(filename)
+    for _ in range(50):
+        store.append({"America/Chicago": 1})
+        store.compact()
+    store.compact(close=True)
+
+
+@pytest.fixture
+def filename(tmp_path):
+    return str(tmp_path / "poll")
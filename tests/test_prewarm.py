@@ -0,0 +1,73 @@
+import asyncio
+import pytest
+
+from aiohttp import ClientSession
+from tzbot import settings
+from tzbot.offsets import OffsetCache
+from tzbot.prewarm import OffsetPrewarmer
+from urllib.parse import urljoin
+
+TIMEZONES = ["Asia/Tokyo", "Europe/London"]
+
+
+@pytest.mark.asyncio
+async def test_should_prewarm_every_timezone_and_restore_it_next_time(
+    response, tztime, tmp_path
+):
+    mock_time_api(response, tztime)
+    filename = str(tmp_path / "snapshot.json")
+    offsets = OffsetCache()
+    prewarmer = OffsetPrewarmer(offsets, filename)
+
+    async with ClientSession() as session:
+        await prewarmer.open(session)
+        while len(offsets.offsets) < len(TIMEZONES):
+            await asyncio.sleep(0.01)
+        await prewarmer.close()
+
+    assert 1 + len(TIMEZONES) == len(response.requests)
+
+    offsets = OffsetCache()
+    async with ClientSession() as session:
+        await OffsetPrewarmer(offsets, filename).open(session)
+
+    assert sorted(TIMEZONES) == sorted(offsets.offsets)
+    assert offsets.time_at("Asia/Tokyo").utcoffset().total_seconds() == 9 * 3600
+
+
+@pytest.mark.asyncio
+async def test_should_refresh_only_what_is_about_to_expire(response, tztime, tmp_path):
+    mock_time_api(response, tztime)
+    offsets = OffsetCache(ttl=60)
+    prewarmer = OffsetPrewarmer(offsets, str(tmp_path / "snapshot.json"))
+
+    async with ClientSession() as session:
+        assert 2 == await prewarmer.refresh(session, TIMEZONES)
+
+    assert [] == offsets.expiring(within=30)
+    assert sorted(TIMEZONES) == sorted(offsets.expiring(within=90))
+
+
+@pytest.mark.asyncio
+async def test_should_start_cold_with_a_broken_snapshot(response, tztime, tmp_path):
+    mock_time_api(response, tztime)
+    (tmp_path / "snapshot.json").write_text('{"Asia/Tokyo": 9}')
+    offsets = OffsetCache()
+    prewarmer = OffsetPrewarmer(offsets, str(tmp_path / "snapshot.json"))
+
+    async with ClientSession() as session:
+        await prewarmer.open(session)
+        assert {} == offsets.offsets
+        await prewarmer.close()
+
+
+def mock_time_api(response, tztime):
+    response.get(
+        urljoin(settings.TIME_API, "/api/timezone"), payload=TIMEZONES, repeat=True
+    )
+    for tz, utc_offset in zip(TIMEZONES, ["+09:00", "+01:00"]):
+        response.get(
+            urljoin(settings.TIME_API, f"/api/timezone/{tz}"),
+            payload={"datetime": tztime.isoformat(), "utc_offset": utc_offset},
+            repeat=True,
+        )
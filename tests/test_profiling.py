@@ -0,0 +1,82 @@
+import asyncio
+import json
+import pstats
+
+import pytest
+
+from tzbot import profiling
+from tzbot.profiling import Profiler, Tracer
+
+
+def test_should_not_record_spans_until_enabled():
+    tracer = Tracer()
+    with tracer.span("command"):
+        pass
+    assert 0 == len(tracer.spans)
+
+    tracer.enabled = True
+    with tracer.span("command", cmd="!timeat"):
+        pass
+    assert 1 == len(tracer.spans)
+    assert ("command", {"cmd": "!timeat"}) == (tracer.spans[0][0], tracer.spans[0][4])
+
+
+def test_should_keep_the_last_spans_only():
+    tracer = Tracer(max_spans=2)
+    tracer.enabled = True
+    for name in ["a", "b", "c"]:
+        with tracer.span(name):
+            pass
+
+    assert ["b", "c"] == [span[0] for span in tracer.spans]
+
+
+@pytest.mark.asyncio
+async def test_should_dump_spans_per_task_in_chrome_trace_format(tmp_path):
+    tracer = Tracer()
+    tracer.enabled = True
+
+    async def command(cmd):
+        with tracer.span("command", cmd=cmd):
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(command("!timeat"), command("!timepopularity"))
+    tracer.dump(tmp_path / "trace.json")
+
+    events = json.loads((tmp_path / "trace.json").read_text())["traceEvents"]
+    assert 2 == len(events)
+    assert {"!timeat", "!timepopularity"} == {e["args"]["cmd"] for e in events}
+    assert all(e["ph"] == "X" and e["dur"] >= 10_000 for e in events)
+    # Every command is on its own track
+    assert events[0]["tid"] != events[1]["tid"]
+
+
+@pytest.mark.asyncio
+async def test_should_trace_while_profiling_to_json(tmp_path):
+    profiler = Profiler(str(tmp_path / "trace.json"))
+    profiler.start()
+    try:
+        assert asyncio.get_running_loop().get_debug()
+        with profiling.tracer.span("command"):
+            pass
+    finally:
+        profiler.stop()
+
+    assert not profiling.tracer.enabled
+    events = json.loads((tmp_path / "trace.json").read_text())["traceEvents"]
+    assert "command" in [e["name"] for e in events]
+
+
+@pytest.mark.asyncio
+async def test_should_dump_cprofile_stats_and_keep_profiling(tmp_path):
+    profiler = Profiler(str(tmp_path / "tzbot.prof"))
+    profiler.start()
+    try:
+        await asyncio.sleep(0)
+        profiler.dump()
+        assert pstats.Stats(str(tmp_path / "tzbot.prof")).total_calls > 0
+        await asyncio.sleep(0)
+    finally:
+        profiler.stop()
+
+    assert pstats.Stats(str(tmp_path / "tzbot.prof")).total_calls > 0
@@ -0,0 +1,20 @@
+from tzbot.ratelimit import TokenBucket
+
+
+def test_should_take_up_to_available_tokens(clock):
+    bucket = TokenBucket(rate=2, burst=3)
+
+    assert 3 == bucket.take(5)
+    assert 0 == bucket.take()
+    assert 0.5 == bucket.delay()
+
+
+def test_should_refill_tokens_over_time_up_to_burst(clock):
+    bucket = TokenBucket(rate=2, burst=3)
+    bucket.take(3)
+
+    clock.now += 1
+    assert 2 == bucket.take(5)
+
+    clock.now += 10
+    assert 3 == bucket.take(5)
@@ -0,0 +1,58 @@
+import gzip
+
+import pytest
+
+from tzbot.poll import PopularityPoll
+from tzbot.rebuild import rebuild_popularity
+
+IRC_LOG = b"""\
+:irc.example.com 001 el_tzbot :Welcome
+:josh!~josh@host PRIVMSG ##mrocha :!timeat Vancouver\r
+:mary!~mary@host PRIVMSG ##mrocha :!timeat New York vancouver\r
+:mary!~mary@host PRIVMSG ##mrocha :!timepopularity America\r
+@time=2021-05-15T22:54:27Z :ann!~ann@host PRIVMSG ##mrocha :!timeat Vancouver\r
+:ann!~ann@host PRIVMSG ##mrocha :is !timeat down?\r
+"""
+STDIO_LOG = b"""\
+josh: !timeat America/Chicago
+josh: !timeat Somewhere
+josh: something about !timeat
+mary: !timeat Vancouver
+"""
+
+
+@pytest.mark.asyncio
+async def test_should_add_requests_in_logs_to_the_poll(tmp_path):
+    filename = str(tmp_path / "poll")
+    (tmp_path / "irc.log").write_bytes(IRC_LOG)
+    with gzip.open(tmp_path / "stdio.log.gz", "wb") as f:
+        f.write(STDIO_LOG)
+
+    counts = rebuild_popularity(
+        [str(tmp_path / "irc.log"), str(tmp_path / "stdio.log.gz")], filename
+    )
+
+    assert {
+        "America/Vancouver": 4,
+        "America/New_York": 1,
+        "America/Chicago": 1,
+    } == counts
+
+    poll = PopularityPoll(filename)
+    await poll.open()
+    await poll.close()
+    assert 6 == poll.get_popularity_of("America")
+    assert [("America/Vancouver", 4)] == poll.get_top_of("America", 1)
+
+
+def test_should_add_to_the_counts_already_there(tmp_path):
+    filename = str(tmp_path / "poll")
+    (tmp_path / "stdio.log").write_bytes(STDIO_LOG)
+
+    rebuild_popularity([str(tmp_path / "stdio.log")], filename)
+    counts = rebuild_popularity([str(tmp_path / "stdio.log")], filename)
+
+    assert {"America/Chicago": 1, "America/Vancouver": 1} == counts
+    assert {"America/Chicago": 2, "America/Vancouver": 2} == (
+        PopularityPoll(filename).store.compact()
+    )
@@ -0,0 +1,98 @@
+import asyncio
+import pytest
+
+from tzbot.scheduler import Scheduler
+
+
+@pytest.mark.asyncio
+async def test_should_not_exceed_max_concurrency():
+    scheduler = Scheduler(max_concurrency=2)
+    peak = 0
+
+    async def job():
+        nonlocal peak
+        peak = max(peak, scheduler.in_flight)
+        await asyncio.sleep(0)
+
+    scheduler.start()
+    for i in range(10):
+        await scheduler.submit(f"nick{i}", job)
+    await scheduler.join()
+    await scheduler.close()
+
+    assert 2 == peak
+    assert 0 == scheduler.queued == scheduler.in_flight
+
+
+@pytest.mark.asyncio
+async def test_should_take_turns_between_nicks():
+    scheduler = Scheduler(max_concurrency=1)
+    order = []
+
+    def job(name):
+        async def run():
+            order.append(name)
+
+        return run
+
+    scheduler.start()
+    for name in ["a1", "a2", "a3", "b1", "c1", "b2"]:
+        await scheduler.submit(name[0], job(name))
+    await scheduler.join()
+    await scheduler.close()
+
+    assert ["a1", "b1", "c1", "a2", "b2", "a3"] == order
+
+
+@pytest.mark.asyncio
+async def test_should_block_submissions_when_queue_is_full():
+    scheduler = Scheduler(max_concurrency=1, max_queued=1)
+    release = asyncio.Event()
+
+    scheduler.start()
+    await scheduler.submit("josh", release.wait)
+    await asyncio.sleep(0)
+    await scheduler.submit("josh", release.wait)
+    blocked = asyncio.create_task(scheduler.submit("josh", release.wait))
+    await asyncio.sleep(0)
+
+    assert not blocked.done()
+    assert 1 == scheduler.queued == scheduler.in_flight
+
+    release.set()
+    await blocked
+    await scheduler.join()
+    await scheduler.close()
+
+
+@pytest.mark.asyncio
+async def test_should_drop_oldest_lowest_priority_jobs_when_shedding():
+    scheduler = Scheduler(max_concurrency=1, max_queued=3, shed=True)
+    release = asyncio.Event()
+    ran = []
+
+    def job(name):
+        async def run():
+            ran.append(name)
+
+        return run
+
+    scheduler.start()
+    await scheduler.submit("josh", release.wait)
+    await asyncio.sleep(0)
+    assert await scheduler.submit("josh", job("low1"), priority=0)
+    assert await scheduler.submit("mary", job("high"), priority=1)
+    assert await scheduler.submit("mary", job("low2"), priority=0)
+    # Full: the oldest low priority job makes room, then the other one
+    assert await scheduler.submit("ann", job("new1"), priority=1)
+    assert await scheduler.submit("ann", job("new2"), priority=1)
+    # Nothing lower left to drop
+    assert not await scheduler.submit("ann", job("low3"), priority=0)
+
+    release.set()
+    await scheduler.join()
+    await scheduler.close()
+
+    assert ["high", "new1", "new2"] == sorted(ran)
+    assert 3 == scheduler.dropped
+    assert 0 == scheduler.queued
@@ -0,0 +1,17 @@
+import subprocess
+import sys
+
+import pytest
+
+
+@pytest.mark.parametrize("module", ["tzbot", "tzbot.__main__"])
+def test_should_not_import_network_modules_on_startup(module):
+    code = f"import sys, {module}; print(*sorted(sys.modules))"
+    process = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    modules = process.stdout.split()
+
+    assert "tzbot" in modules
+    assert "aiohttp" not in modules
+    assert "shelve" not in modules
@@ -0,0 +1,186 @@
+import asyncio
+import os
+import pytest
+
+from tzbot import settings
+from tzbot.stream import IRCConnection, StdioStream, parse_stdio_message
+
+
+@pytest.mark.asyncio
+async def test_should_read_and_write_commands_through_pipes():
+    (in_r, in_w), (out_r, out_w) = os.pipe(), os.pipe()
+    istream, ostream = open(in_r, "rb", buffering=0), open(out_w, "wb", buffering=0)
+    stream = StdioStream(istream, ostream)
+    await stream.connect()
+
+    os.write(in_w, b"hello\njosh: !timeat America/Chicago\n")
+    os.close(in_w)
+    command = await stream.read_command()
+    await stream.send_message("josh", "first")
+    await stream.send_message("josh", "second")
+    await stream.close()
+
+    assert stream.reader is not None and stream.writer is not None
+    assert ("josh", "!timeat", ["America/Chicago"]) == command
+    assert b"first\nsecond\n" == os.read(out_r, 1024)
+    with pytest.raises(EOFError):
+        await stream.read_command()
+
+    ostream.close()
+    os.close(out_r)
+
+
+def test_should_parse_stdio_commands():
+    stream = StdioStream()
+
+    assert ("josh", "!timeat", ["Etc/GMT+10"]) == stream._parse_command(
+        "josh:  !timeat Etc/GMT+10\n"
+    )
+    assert stream._parse_command("josh: !timeat") is None
+    assert stream._parse_command("josh: what !timeat is it") is None
+    assert stream._parse_command("9josh: !timeat Etc/GMT+10") is None
+
+
+def test_should_parse_stdio_messages():
+    assert ("josh", "hello there") == parse_stdio_message("josh: hello there\n")
+    assert parse_stdio_message("josh hello there") is None
+
+
+def test_should_parse_irc_commands():
+    connection = IRCConnection("localhost", 6667, "tzbot")
+    line = (
+        b"@time=2021-05-15T22:54:27Z :josh!~josh@host PRIVMSG #chan :!timeat Vancouver"
+    )
+
+    assert ("#chan", ("josh", "!timeat", ["Vancouver"])) == connection._parse_command(
+        line
+    )
+    assert connection._parse_command(b":josh!~josh@host PRIVMSG #chan :hello") is None
+    assert connection._parse_command(b":server NOTICE #chan :!timeat Vancouver") is None
+    assert connection._parse_command(b"PING :!timeat") is None
+
+
+@pytest.mark.asyncio
+async def test_should_rate_limit_messages_but_not_control_lines(monkeypatch):
+    monkeypatch.setattr(settings, "IRC_SEND_BURST", 2)
+    server = await IRCServer.start(b"PING :server\r\n")
+    connection = IRCConnection("127.0.0.1", server.port, "tzbot")
+    await connection.connect()
+    stream = connection.join("#channel")
+
+    sending = [
+        asyncio.create_task(stream.send_message("josh", str(i))) for i in range(3)
+    ]
+    await asyncio.sleep(0.1)
+    lines = server.received()
+
+    assert [b"NICK", b"USER"] == [line.split()[0] for line in lines[:2]]
+    assert [b"PRIVMSG #channel :0\r\n", b"PRIVMSG #channel :1\r\n"] == [
+        line for line in lines if line.startswith(b"PRIVMSG")
+    ]
+    assert b"JOIN #channel\r\n" in lines and b"PONG :server\r\n" in lines
+    assert 2 == connection.sent and sum(not t.done() for t in sending) == 1
+
+    await connection.close()
+    server.close()
+    with pytest.raises(ConnectionError):
+        await sending[2]
+
+
+@pytest.mark.asyncio
+async def test_should_route_commands_and_replies_per_channel():
+    server = await IRCServer.start(
+        b":josh!j@h PRIVMSG #one :!timeat Vancouver\r\n"
+        b":mary!m@h PRIVMSG #two :!timepopularity America\r\n"
+        b":mary!m@h PRIVMSG #three :!timeat Vancouver\r\n"
+    )
+    connection = IRCConnection("127.0.0.1", server.port, "tzbot")
+    await connection.connect()
+    one, two = connection.join("#one"), connection.join("#TWO")
+
+    assert ("josh", "!timeat", ["Vancouver"]) == await one.read_command()
+    assert ("mary", "!timepopularity", ["America"]) == await two.read_command()
+
+    await two.send_message("mary", "0")
+    await server.wait_for(b"PRIVMSG #TWO :0\r\n")
+    server.close_clients()
+    with pytest.raises(EOFError):
+        await one.read_command()
+
+    await connection.close()
+    server.close()
+
+
+@pytest.mark.asyncio
+async def test_should_drop_commands_but_answer_pings_once_a_queue_is_full(monkeypatch):
+    monkeypatch.setattr(settings, "MAX_QUEUED_COMMANDS", 1)
+    server = await IRCServer.start(
+        b":josh!j@h PRIVMSG #one :!timeat Vancouver\r\n"
+        b":josh!j@h PRIVMSG #one :!timeat Lima\r\n"
+        b"@time=2021-05-15T22:54:27Z :server PING :server\r\n"
+    )
+    connection = IRCConnection("127.0.0.1", server.port, "tzbot")
+    await connection.connect()
+    one = connection.join("#one")
+
+    await server.wait_for(b"PONG :server\r\n")
+    assert ("josh", "!timeat", ["Vancouver"]) == await one.read_command()
+    assert one.commands.empty()
+
+    await connection.close()
+    server.close()
+
+
+@pytest.mark.asyncio
+async def test_should_fail_to_send_once_connection_is_closed():
+    server = await IRCServer.start()
+    connection = IRCConnection("127.0.0.1", server.port, "tzbot")
+    await connection.connect()
+    stream = connection.join("#channel")
+
+    await connection.close()
+    server.close()
+
+    with pytest.raises(ConnectionError):
+        await stream.send_message("josh", "too late")
+
+
+class IRCServer:
+    """An IRC server that greets with some lines and records what it gets."""
+
+    def __init__(self, greeting):
+        self.greeting = greeting
+        self.lines = []
+        self.writers = []
+
+    @classmethod
+    async def start(cls, greeting=b""):
+        server = cls(greeting)
+        server.server = await asyncio.start_server(server.serve, "127.0.0.1", 0)
+        server.port = server.server.sockets[0].getsockname()[1]
+        return server
+
+    async def serve(self, reader, writer):
+        self.writers.append(writer)
+        writer.write(self.greeting)
+        await writer.drain()
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            self.lines.append(line)
+
+    def received(self):
+        return list(self.lines)
+
+    async def wait_for(self, line):
+        while line not in self.lines:
+            await asyncio.sleep(0.01)
+
+    def close_clients(self):
+        for writer in self.writers:
+            writer.close()
+
+    def close(self):
+        self.close_clients()
+        self.server.close()
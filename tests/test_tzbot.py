@@ -34,6 +34,76 @@ async def test_should_return_time_when_given_an_aliased_timezone(
     assert mock.call_args.args[0] == "America/Vancouver"
 
 
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "name", ["vancouver", "VANCOUVER", "Vancou", "america/vancouver"]
+)
+async def test_should_resolve_aliases_loosely(
+    mocker, bot, tztime, formatted_tztime, stream, name
+):
+    mock = mocker.patch("tzbot.api_client.get_time_at", return_value=tztime)
+    send_message(stream, bot, f"josh: !timeat {name}")
+
+    await bot.run()
+
+    assert formatted_tztime == recv_message(stream, bot)
+    assert mock.call_args.args[0] == "America/Vancouver"
+
+
+@pytest.mark.asyncio
+async def test_should_return_time_when_given_a_timezone_with_spaces(
+    mocker, bot, tztime, formatted_tztime, stream
+):
+    mock = mocker.patch("tzbot.api_client.get_time_at", return_value=tztime)
+    send_message(stream, bot, "josh: !timeat New York")
+
+    await bot.run()
+
+    assert formatted_tztime == recv_message(stream, bot)
+    assert mock.call_count == 1
+    assert mock.call_args.args[0] == "America/New_York"
+
+
+@pytest.mark.asyncio
+async def test_should_answer_several_timezones_in_one_message(
+    mocker, bot, tztime, formatted_tztime, stream
+):
+    async def get_time_at(tz, *args):
+        if tz == "Somewhere":
+            raise api.APIError("unknown timezone")
+        return tztime
+
+    mock = mocker.patch("tzbot.api_client.get_time_at", side_effect=get_time_at)
+    send_message(stream, bot, "josh: !timeat Vancouver New York vancouver Somewhere")
+
+    await bot.run()
+
+    time = formatted_tztime.strip()
+    assert (
+        f"Vancouver: {time} | New York: {time} | Somewhere: unknown timezone\n"
+        == recv_message(stream, bot)
+    )
+    assert mock.call_count == 3
+    assert bot.poll.get_popularity_of("America") == 2
+
+
+@pytest.mark.asyncio
+async def test_should_reuse_answers_within_the_same_minute(
+    mocker, bot, tztime, formatted_tztime
+):
+    mock = mocker.patch("tzbot.api_client.get_time_at", return_value=tztime)
+
+    async with bot.started():
+        assert formatted_tztime.strip() == await bot._answer("!timeat", ["Vancouver"])
+        assert formatted_tztime.strip() == await bot._answer(
+            "!timeat", ["America/Vancouver"]
+        )
+
+    assert mock.call_count == 1
+    assert bot.poll.get_popularity_of("America/Vancouver") == 2
+    assert (1, 1) == (bot.responses.hits, bot.responses.misses)
+
+
 @pytest.mark.asyncio
 async def test_should_return_error_when_given_invalid_timezone(
     mocker, bot, tztime, formatted_tztime, stream
@@ -84,6 +154,33 @@ async def test_should_return_popularity_when_given_a_timezone(
     assert "0\n" == responses[5]
 
 
+@pytest.mark.asyncio
+async def test_should_return_top_timezones_and_recent_popularity(
+    mocker, bot, tztime, stream
+):
+    mocker.patch("tzbot.api_client.get_time_at", return_value=tztime)
+    messages = [
+        "josh: !timeat America/Chicago",
+        "mary: !timeat America/Chicago",
+        "josh: !timeat America/Lima",
+        "josh: !timepopularity America top",
+        "josh: !timepopularity America top 1",
+        "josh: !timepopularity America hour",
+        "josh: !timepopularity Europe top",
+        "josh: !timepopularity America week",
+    ]
+    send_messages(stream, bot, messages)
+
+    await bot.run()
+
+    responses = recv_messages(stream, bot, len(messages))[3:]
+    assert "America/Chicago: 2 | America/Lima: 1\n" == responses[0]
+    assert "America/Chicago: 2\n" == responses[1]
+    assert "3\n" == responses[2]
+    assert "0\n" == responses[3]
+    assert "" == responses[4]
+
+
 @pytest.mark.asyncio
 async def test_should_not_update_counter_for_invalid_timezones(mocker, bot, stream):
     mocker.patch(
@@ -123,6 +220,58 @@ async def test_should_update_counter_for_aliased_timezones(
     assert "1\n" == responses[1]
 
 
+@pytest.mark.asyncio
+async def test_should_answer_on_the_stream_each_command_came_from(
+    mocker, tztime, formatted_tztime, stream
+):
+    mocker.patch("tzbot.api_client.get_time_at", return_value=tztime)
+    other = MockStream()
+    bot = TZBot(stream, other)
+    send_message(stream, bot, "josh: !timeat Vancouver")
+    # Not counting Vancouver, whichever command is answered first
+    send_message(other, bot, "mary: !timepopularity Europe")
+
+    await bot.run()
+
+    assert formatted_tztime == recv_message(stream, bot)
+    assert "0\n" == recv_message(other, bot)
+
+
+@pytest.mark.asyncio
+async def test_should_answer_every_command_from_stdio(
+    mocker, bot, tztime, formatted_tztime, stream
+):
+    mocker.patch("tzbot.api_client.get_time_at", return_value=tztime)
+    messages = ["josh: !timeat Vancouver"] * (settings.NICK_COMMAND_BURST + 5)
+    send_messages(stream, bot, messages)
+
+    await bot.run()
+
+    assert [formatted_tztime] * len(messages) == recv_messages(
+        stream, bot, len(messages)
+    )
+
+
+@pytest.mark.asyncio
+async def test_should_drop_repeated_commands_from_the_same_nick(
+    mocker, tztime, formatted_tztime, stream, monkeypatch
+):
+    monkeypatch.setattr(settings, "LIMIT_NICKS", True)
+    bot = TZBot(stream)
+    mocker.patch("tzbot.api_client.get_time_at", return_value=tztime)
+    messages = [
+        "josh: !timeat Vancouver",
+        "josh: !timeat Vancouver",
+        "mary: !timeat Vancouver",
+    ]
+    send_messages(stream, bot, messages)
+
+    await bot.run()
+
+    assert [formatted_tztime] * 2 + [""] == recv_messages(stream, bot, 3)
+    assert bot.poll.get_popularity_of("America/Vancouver") == 2
+
+
 class MockStream(StdioStream):
     def __init__(self):
         super().__init__(StringIO(), StringIO())
@@ -0,0 +1,30 @@
+from tzbot.window import SlidingWindow
+
+
+def test_should_count_within_the_span_only(clock):
+    counter = SlidingWindow(span=60, buckets=6)
+    counter.add(["America", "America/Lima"])
+    clock.now += 30
+    counter.add(["America"], 2)
+
+    assert 3 == counter.count("America")
+    assert 1 == counter.count("America/Lima")
+
+    clock.now += 30
+    assert 2 == counter.count("America")
+    assert 0 == counter.count("America/Lima")
+
+    clock.now += 30
+    assert 0 == counter.count("America")
+    assert {} == counter.totals
+
+
+def test_should_empty_every_bucket_after_a_long_while(clock):
+    counter = SlidingWindow(span=60, buckets=6)
+    for _ in range(6):
+        counter.add(["America"])
+        clock.now += 10
+
+    clock.now += 3600
+    assert 0 == counter.count("America")
+    assert [{}] * 6 == counter.buckets
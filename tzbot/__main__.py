@@ -1,12 +1,17 @@
 import argparse
 import asyncio
+import logging
+import sys
 
-from signal import SIGINT, SIGTERM
+from signal import SIGINT, SIGTERM, SIGUSR1
+from typing import List, Optional, Tuple
 
-from . import log, settings, TZBot, utils
-from .stream import StdioStream, IRCStream
+from . import log, metrics, rebuild, settings, TZBot, utils
+from .profiling import Profiler
+from .batch import BatchRunner
+from .stream import StdioStream, IRCConnection
 
-logger = log.setup_logger("tzbot")
+logger = logging.getLogger("tzbot")
 
 
 def parse_args() -> argparse.Namespace:
@@ -19,7 +24,22 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument(
         "--aliases",
         action="store_true",
-        help="Generates and rewrites the aliases JSON file. Then exits",
+        help="Generates and rewrites the aliases JSON file and its index. Then exits",
+    )
+    parser.add_argument(
+        "--rebuild-popularity",
+        nargs="+",
+        metavar="LOG",
+        help="Adds the !timeat requests in the IRC or STDIO logs (.gz too) to "
+        "the popularity poll. Then exits",
+    )
+    parser.add_argument(
+        "--batch",
+        nargs="?",
+        const="-",
+        metavar="FILE",
+        help="Answers every command in FILE (or STDIN if omitted) in bulk, "
+        "writing the answers in order to STDOUT. Then exits",
     )
     parser.add_argument(
         "--tag",
@@ -31,55 +51,214 @@ def parse_args() -> argparse.Namespace:
         help="Time API URL. This takes precedence over the environment variable",
         default=settings.TIME_API,
     )
+    parser.add_argument(
+        "--time-api-mirror",
+        help="Time API mirror, asked when the time API is slow or failing. "
+        "This takes precedence over the environment variable",
+        default=settings.TIME_API_MIRROR,
+    )
+    parser.add_argument(
+        "--prewarm",
+        action="store_true",
+        help="Restores the UTC offsets saved by the last run, then fetches the "
+        "offsets of every timezone and keeps them fresh in the background",
+    )
+    parser.add_argument(
+        "--http-cache",
+        metavar="FILE",
+        help="Keeps the cacheable time API responses in FILE between runs "
+        "(e.g. the timezones list used by --aliases and --prewarm)",
+        default=settings.HTTP_CACHE_FILENAME,
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="If given, serves metrics in the Prometheus text format at "
+        f"http://{settings.METRICS_HOST}:METRICS_PORT/metrics",
+        default=settings.METRICS_PORT,
+    )
+    parser.add_argument(
+        "--log-level",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+        help="Logs only from this level up",
+        default=settings.LOG_LEVEL,
+    )
+    parser.add_argument(
+        "--log-json",
+        action="store_true",
+        help="Logs a JSON object per line instead of text",
+    )
+    parser.add_argument(
+        "--log-sample",
+        action="append",
+        type=log_sample,
+        metavar="CATEGORY=RATE",
+        help="Logs only a RATE fraction (0 to 1) of the per-command logs of "
+        "CATEGORY: commands (each one received, answered, ignored or rejected) "
+        "or irc (each command parsed or PING answered). Can be repeated",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="FILE",
+        help="Profiles the bot, logging slow callbacks and dumping the results "
+        "to FILE on SIGUSR1 and at exit. If FILE ends in .json, command spans "
+        "are traced in the Chrome trace format. Otherwise, cProfile stats are "
+        "dumped",
+    )
     parser.add_argument(
         "--irc-server", help="IRC server to connect to", default=settings.IRC_SERVER
     )
     parser.add_argument(
-        "--irc-channel", help="IRC channel to join to", default=settings.IRC_CHANNEL
+        "--irc-channel",
+        help="IRC channel to join to. Several can be given separated by commas",
+        default=settings.IRC_CHANNEL,
+    )
+    parser.add_argument(
+        "--irc-network",
+        action="append",
+        type=irc_network,
+        metavar="SERVER[:PORT]=CHANNEL[,CHANNEL...]",
+        help="IRC server and channels to join to. Can be repeated to serve "
+        "several networks at once. This takes precedence over --irc-server "
+        "and --irc-channel",
     )
 
     return parser.parse_args()
 
 
+def irc_network(value: str) -> Tuple[str, int, List[str]]:
+    """Parses a `SERVER[:PORT]=CHANNEL[,CHANNEL...]` argument."""
+    address, _, channels = value.partition("=")
+    server, _, port = address.partition(":")
+
+    if not server or not channels or not (port or "0").isdigit():
+        raise argparse.ArgumentTypeError(f"invalid IRC network: '{value}'")
+
+    return server, int(port or settings.IRC_PORT), channels.split(",")
+
+
+def log_sample(value: str) -> Tuple[str, float]:
+    """Parses a `CATEGORY=RATE` argument."""
+    category, _, rate = value.partition("=")
+    try:
+        if category and 0 <= float(rate) <= 1:
+            return category, float(rate)
+    except ValueError:
+        pass
+    raise argparse.ArgumentTypeError(f"invalid log sampling: '{value}'")
+
+
 def update_settings(args: argparse.Namespace) -> None:
     settings.TAG_USER = args.tag
     settings.TIME_API = args.time_api
+    settings.TIME_API_MIRROR = args.time_api_mirror
+    settings.PREWARM = args.prewarm
+    settings.METRICS_PORT = args.metrics_port
+    # Falling behind on IRC only makes every answer late, and a nick can
+    # take it all. Unlike on STDIO, where every command is to be answered
+    settings.SHED_LOAD = settings.LIMIT_NICKS = args.irc
     settings.IRC_SERVER = args.irc_server
     settings.IRC_CHANNEL = args.irc_channel
+    settings.IRC_NETWORKS = args.irc_network or [
+        (args.irc_server, settings.IRC_PORT, args.irc_channel.split(","))
+    ]
 
 
-def register_signal_handlers() -> None:
+def register_signal_handlers(profiler: Optional[Profiler] = None) -> None:
     loop = asyncio.get_running_loop()
     task = asyncio.current_task()
 
     for signal in [SIGINT, SIGTERM]:
         loop.add_signal_handler(signal, task.cancel)
 
+    if profiler:
+        loop.add_signal_handler(SIGUSR1, profiler.dump)
+
 
 async def async_entry_point() -> None:
     args = parse_args()
+    settings.LOG_LEVEL = args.log_level
+    settings.LOG_JSON = args.log_json
+    settings.LOG_SAMPLE_RATES = dict(args.log_sample or [])
+    log.setup_logger("tzbot")
+    settings.HTTP_CACHE_FILENAME = args.http_cache
 
     if args.aliases:
         logger.info("Generating aliases.json file...")
         await utils.generate_aliases()
         return
 
+    if args.rebuild_popularity:
+        logger.info("Rebuilding the popularity poll...")
+        rebuild.rebuild_popularity(args.rebuild_popularity)
+        return
+
     update_settings(args)
-    register_signal_handlers()
+    profiler = Profiler(args.profile) if args.profile else None
+    register_signal_handlers(profiler)
+
+    if profiler:
+        profiler.start()
+        try:
+            await run(args)
+        finally:
+            profiler.stop()
+    else:
+        await run(args)
+
+
+async def run(args: argparse.Namespace) -> None:
+    if args.batch:
+        await run_batch(args.batch)
+        return
+
+    if settings.METRICS_PORT:
+        metrics_server = await metrics.serve()
+        try:
+            await run_bot(args)
+        finally:
+            await metrics_server.cleanup()
+    else:
+        await run_bot(args)
+
+
+async def run_bot(args: argparse.Namespace) -> None:
+    connections, streams = [], []
 
     if args.irc:
-        stream = IRCStream(
-            settings.IRC_SERVER,
-            settings.IRC_PORT,
-            settings.IRC_NICK,
-            settings.IRC_CHANNEL,
-        )
-        await stream.connect()
+        # A single connection per server, no matter how many channels
+        networks = {}
+        for server, port, channels in settings.IRC_NETWORKS:
+            networks.setdefault((server, port), []).extend(channels)
+
+        for (server, port), channels in networks.items():
+            connection = IRCConnection(server, port, settings.IRC_NICK)
+            connections.append(connection)
+            await connection.connect()
+            streams.extend(connection.join(channel) for channel in channels)
     else:
-        stream = StdioStream()
+        streams.append(StdioStream())
+        await streams[0].connect()
+
+    bot = TZBot(*streams)
+    try:
+        await bot.run()
+    finally:
+        for closeable in [*streams, *connections]:
+            await closeable.close()
 
-    bot = TZBot(stream)
-    await bot.run()
+
+async def run_batch(filename: str) -> None:
+    istream = sys.stdin if filename == "-" else open(filename)
+    stream = StdioStream(istream)
+    await stream.connect()
+
+    try:
+        await BatchRunner(TZBot(), stream).run()
+    finally:
+        await stream.close()
+        if istream is not sys.stdin:
+            istream.close()
 
 
 def main() -> None:
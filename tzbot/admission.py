@@ -0,0 +1,78 @@
+import time
+
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from . import settings
+from .ratelimit import TokenBucket
+
+
+class _Nick:
+    __slots__ = ("bucket", "last_command", "last_at")
+
+    def __init__(self, bucket: TokenBucket) -> None:
+        self.bucket = bucket
+        self.last_command: Optional[Tuple[str, Tuple[str, ...]]] = None
+        self.last_at = 0.0
+
+
+class AdmissionControl:
+    r"""Decides which commands are worth queueing at all.
+
+    Every nick gets a token bucket refilled at `rate` commands per
+    second up to `burst`, so a nick sending commands in a loop only
+    uses up its own share of the time API. The same command from the
+    same nick within `duplicate_window` seconds of the last admitted
+    one is dropped too, as its answer would be the same.
+
+    Only the last `max_nicks` nicks seen are kept track of.
+
+    Arguments:
+
+        rate -- Defaults to `settings.NICK_COMMAND_RATE`.
+
+        burst -- Defaults to `settings.NICK_COMMAND_BURST`.
+
+        duplicate_window -- Defaults to `settings.DUPLICATE_WINDOW`.
+
+        max_nicks -- Defaults to `settings.ADMISSION_MAX_NICKS`.
+    """
+
+    def __init__(
+        self,
+        rate: Optional[float] = None,
+        burst: Optional[int] = None,
+        duplicate_window: Optional[float] = None,
+        max_nicks: Optional[int] = None,
+    ) -> None:
+        self.rate = rate or settings.NICK_COMMAND_RATE
+        self.burst = burst or settings.NICK_COMMAND_BURST
+        self.duplicate_window = (
+            settings.DUPLICATE_WINDOW if duplicate_window is None else duplicate_window
+        )
+        self.max_nicks = max_nicks or settings.ADMISSION_MAX_NICKS
+        self.nicks: "OrderedDict[str, _Nick]" = OrderedDict()
+
+    def admit(self, nick: str, cmd: str, args: List[str]) -> Optional[str]:
+        """Returns why the command is rejected, or None if it's admitted."""
+        state = self._state_of(nick)
+        command, now = (cmd, tuple(args)), time.monotonic()
+
+        recent = now - state.last_at < self.duplicate_window
+        if recent and command == state.last_command:
+            return "duplicate"
+        if not state.bucket.take():
+            return "rate_limited"
+
+        state.last_command, state.last_at = command, now
+        return None
+
+    def _state_of(self, nick: str) -> _Nick:
+        state = self.nicks.get(nick)
+        if state is None:
+            state = self.nicks[nick] = _Nick(TokenBucket(self.rate, self.burst))
+            while len(self.nicks) > self.max_nicks:
+                self.nicks.popitem(last=False)
+        else:
+            self.nicks.move_to_end(nick)
+        return state
@@ -0,0 +1,120 @@
+import importlib.resources as pkg_resources
+import json
+import logging
+
+from bisect import bisect_left
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+from . import settings
+
+logger = logging.getLogger("tzbot")
+
+INDEX_FILENAME = "alias_index.json"
+
+
+class AliasIndex:
+    r"""Resolves aliases and timezone names to full timezone names.
+
+    Lookups ignore case and take spaces as underscores, so `new york`,
+    `New_York` and `america/new_york` all resolve to `America/New_York`.
+    Prefixes of at least `settings.ALIAS_MIN_PREFIX` characters shared
+    by a single timezone resolve to it too (e.g. `vancou`).
+
+    The index is precomputed by `utils.generate_aliases()` as sorted
+    lists of keys and the timezones they map to, so prefix lookups are
+    a binary search. It is loaded on first lookup.
+
+    Arguments:
+
+        filename -- Index file. Defaults to the one in the package.
+    """
+
+    def __init__(self, filename: Optional[str] = None) -> None:
+        self.filename = filename
+        self.loaded = False
+        self.keys: List[str] = []
+        self.targets: List[int] = []
+        self.timezones: List[str] = []
+        self.exact: Dict[str, int] = {}
+
+    def resolve(self, name: str) -> Optional[str]:
+        """Returns the timezone name refers to, or None if there is none."""
+        if not self.loaded:
+            self._load()
+
+        key = normalize(name)
+        if key in self.exact:
+            return self.timezones[self.exact[key]]
+        if len(key) < settings.ALIAS_MIN_PREFIX:
+            return None
+
+        start = bisect_left(self.keys, key)
+        if start == len(self.keys) or not self.keys[start].startswith(key):
+            return None
+
+        # Every key past the prefix sorts after its last character bumped
+        end = bisect_left(self.keys, key[:-1] + chr(ord(key[-1]) + 1), start)
+        targets = set(self.targets[start:end])
+        if len(targets) != 1:
+            return None
+        return self.timezones[targets.pop()]
+
+    def split(self, words: List[str], max_names: int) -> List[str]:
+        """Groups words into up to max_names timezone names.
+
+        Known names with spaces (e.g. `New York`) are kept together,
+        preferring the longest ones.
+        """
+        names, start = [], 0
+        while start < len(words) and len(names) < max_names:
+            end = min(len(words), start + settings.ALIAS_MAX_WORDS)
+            while end - start > 1 and not self.resolve(" ".join(words[start:end])):
+                end -= 1
+            names.append(" ".join(words[start:end]))
+            start = end
+        return names
+
+    def _load(self) -> None:
+        self.loaded = True
+
+        if self.filename:
+            index = _read_index(Path(self.filename))
+        else:
+            with pkg_resources.path(__package__, INDEX_FILENAME) as path:
+                index = _read_index(path)
+
+        if index:
+            self.keys, self.targets = index["keys"], index["targets"]
+            self.timezones = index["timezones"]
+            self.exact = dict(zip(self.keys, self.targets))
+
+
+def _read_index(path: Path) -> Optional[Dict[str, list]]:
+    if not path.exists():
+        logger.warning(f"{path.name} was not found")
+        return None
+    with path.open() as f:
+        return json.load(f)
+
+
+def normalize(name: str) -> str:
+    return name.strip().casefold().replace(" ", "_")
+
+
+def build_index(aliases: Dict[str, str]) -> Dict[str, Union[List[str], List[int]]]:
+    """Builds the index of the aliases and the timezone names they map to."""
+    timezones = sorted(set(aliases.values()))
+    position = {tz: i for i, tz in enumerate(timezones)}
+
+    entries = {normalize(tz): position[tz] for tz in timezones}
+    for alias, tz in aliases.items():
+        if entries.setdefault(normalize(alias), position[tz]) != position[tz]:
+            raise RuntimeError(f"conflicting alias between timezones: {alias}")
+
+    keys = sorted(entries)
+    return {
+        "timezones": timezones,
+        "keys": keys,
+        "targets": [entries[key] for key in keys],
+    }
@@ -1,83 +1,415 @@
-import aiohttp
 import asyncio
 import json
+import time
 
-from aiohttp import ClientSession
 from datetime import datetime
-from typing import Any, Callable, Dict, List
+from functools import partial
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 from urllib.parse import urljoin
 
+from . import metrics
+from . import profiling
 from . import utils
 from . import settings
+from .httpcache import HTTPCache
+from .offsets import OffsetCache
+
+if TYPE_CHECKING:
+    from aiohttp import ClientSession
 
 
 class APIError(RuntimeError):
     """An API error occurred."""
 
 
+class UnknownTimezoneError(APIError):
+    """The requested timezone doesn't exist."""
+
+
+class CircuitOpenError(APIError):
+    """The time API is failing, so it isn't called for a while."""
+
+
 class RetriableError(RuntimeError):
     """A retriable error occurred."""
 
 
+class SingleFlight:
+    """Shares a single in-flight call among concurrent identical calls.
+
+    Callers asking for a key while a call for it is still running wait
+    for that call and get its result, or its exception, instead of
+    making their own. The number of calls spared is kept in
+    `coalesced`.
+    """
+
+    def __init__(self) -> None:
+        self.calls: Dict[Hashable, asyncio.Future] = {}
+        self.coalesced = 0
+
+    async def call(
+        self, key: Hashable, func: Callable[..., Awaitable[Any]], *args
+    ) -> Any:
+        task = self.calls.get(key)
+
+        if task is None:
+            task = asyncio.ensure_future(func(*args))
+            task.add_done_callback(lambda t: self._forget(key, t))
+            self.calls[key] = task
+        else:
+            self.coalesced += 1
+
+        # Cancelling a caller must not cancel the call for the others
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Future) -> None:
+        if self.calls.get(key) is task:
+            del self.calls[key]
+        # Mark the exception as retrieved in case every caller went away
+        if not task.cancelled():
+            task.exception()
+
+
+class CircuitBreaker:
+    r"""Fails calls fast while the time API keeps failing.
+
+    After `max_failures` failed calls in a row the circuit opens, and
+    calls are refused for `reset_after` seconds. Then a single trial
+    call is let through: if it succeeds the circuit closes again,
+    otherwise it stays open for another `reset_after` seconds.
+
+    Arguments:
+
+        max_failures -- Defaults to `settings.CIRCUIT_MAX_FAILURES`.
+
+        reset_after -- Defaults to `settings.CIRCUIT_RESET_AFTER`.
+    """
+
+    def __init__(
+        self, max_failures: Optional[int] = None, reset_after: Optional[float] = None
+    ) -> None:
+        self.max_failures = max_failures or settings.CIRCUIT_MAX_FAILURES
+        self.reset_after = reset_after or settings.CIRCUIT_RESET_AFTER
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial = False
+
+    @property
+    def open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow(self) -> bool:
+        """Returns whether a call can be made now."""
+        if self.opened_at is None:
+            return True
+        if self.trial or time.monotonic() - self.opened_at < self.reset_after:
+            return False
+        self.trial = True
+        return True
+
+    def record(self, success: bool) -> None:
+        """Records the outcome of an allowed call."""
+        self.trial = False
+        if success:
+            self.failures, self.opened_at = 0, None
+            return
+
+        self.failures += 1
+        if self.failures >= self.max_failures:
+            self.opened_at = time.monotonic()
+
+
+time_at_calls = SingleFlight()
+circuit = CircuitBreaker()
+http_cache = HTTPCache()
+metrics.API_COALESCED.set_function(lambda: time_at_calls.coalesced)
+metrics.API_CIRCUIT_OPEN.set_function(lambda: int(circuit.open))
+
+
 def backoff(func: Callable[..., Any]) -> Callable[..., Any]:
-    """Decorator for exponential backoff retries."""
+    """Decorator for exponential backoff retries.
+
+    If a `deadline` keyword argument is given (in event loop time), it
+    gives up rather than wait for a retry past it.
+    """
 
     async def wrapper(*args, **kwargs) -> Any:
         retries = settings.BACKOFF_MAX_RETRIES
         delay = settings.BACKOFF_INITIAL_WAIT
         step = 2
         last_error = None
+        deadline = kwargs.get("deadline")
+        loop = asyncio.get_running_loop()
 
         while retries > 0:
             try:
                 return await func(*args, **kwargs)
             except RetriableError as e:
+                metrics.API_RETRIES.inc(error=str(e))
                 last_error = e
-                await asyncio.sleep(delay)
-                delay *= step
                 retries -= 1
 
+            if retries == 0 or (deadline and loop.time() + delay >= deadline):
+                break
+            await asyncio.sleep(delay)
+            delay *= step
+
         raise APIError(str(last_error))
 
     return wrapper
 
 
-@backoff
-async def get_time_at(timezone: str, session: ClientSession) -> datetime:
-    """Makes a request to get the time at the given timezone."""
+async def get_time_at(
+    timezone: str,
+    session: "ClientSession",
+    offsets: Optional[OffsetCache] = None,
+    deadline: Optional[float] = None,
+) -> datetime:
+    """Retrieves the time at the given timezone.
+
+    If an offsets cache is given, the time is computed locally for as
+    long as the cached UTC offset of the timezone holds, and the local
+    timezone database is used when the API is unreachable.
+
+    If a deadline is given (in event loop time), the API is not waited
+    for past it. Concurrent calls for the same timezone share a single
+    request, which runs under the deadline of the call that started it:
+    later calls wait no longer than that, even if theirs is later, and
+    on failure fall back like the first one.
+    """
     if not utils.is_valid_timezone(timezone):
         return None
 
-    response = await _make_call(f"/api/timezone/{timezone}", session)
+    fetch_time_at = partial(_fetch_time_at, deadline=deadline)
+
+    if offsets is None:
+        tztime, _ = await time_at_calls.call(timezone, fetch_time_at, timezone, session)
+        return tztime
+
+    tztime = offsets.time_at(timezone)
+    if tztime is not None:
+        return tztime
 
     try:
-        return datetime.fromisoformat(response.get("datetime", ""))
-    except ValueError:
-        raise RetriableError("time is unavailable")
+        tztime, response = await time_at_calls.call(
+            timezone, fetch_time_at, timezone, session
+        )
+    except UnknownTimezoneError:
+        raise
+    except APIError:
+        tztime = offsets.local_time_at(timezone)
+        if tztime is None:
+            raise
+        return tztime
+
+    offsets.update(timezone, response)
+    return tztime
+
+
+async def fetch_offset(
+    timezone: str, session: "ClientSession", offsets: OffsetCache
+) -> None:
+    """Asks the time API for the UTC offset of timezone, caching it."""
+    _, response = await time_at_calls.call(timezone, _fetch_time_at, timezone, session)
+    offsets.update(timezone, response)
+
+
+async def get_times_at(
+    timezones: List[str],
+    session: "ClientSession",
+    offsets: Optional[OffsetCache] = None,
+    deadline: Optional[float] = None,
+) -> Dict[str, Union[datetime, APIError]]:
+    """Retrieves the time at several timezones at once.
+
+    Every distinct timezone is looked up once, all of them concurrently.
+    Returns the time at each timezone, or the APIError that prevented
+    retrieving it.
+    """
+    unique = list(dict.fromkeys(timezones))
+    lookups = [_settled(get_time_at(tz, session, offsets, deadline)) for tz in unique]
+    if len(lookups) == 1:
+        # Spare scheduling a task for the common case
+        results = [await lookups[0]]
+    else:
+        results = await asyncio.gather(*lookups)
+
+    return {
+        tz: UnknownTimezoneError("unknown timezone") if result is None else result
+        for tz, result in zip(unique, results)
+    }
+
+
+async def _settled(lookup: Awaitable[datetime]) -> Union[datetime, APIError]:
+    try:
+        return await lookup
+    except APIError as e:
+        return e
 
 
 @backoff
-async def get_timezones(session: ClientSession) -> List[str]:
+async def get_timezones(session: "ClientSession") -> List[str]:
     """Makes a request to retrieve all available timezones."""
-    return await _make_call(f"/api/timezone", session)
+    return await _make_call(f"/api/timezone", session, cached=True)
 
 
-async def _make_call(path: str, session: ClientSession) -> Dict[str, Any]:
-    """Makes a REST GET request to the `TIME_API` service."""
-    url = urljoin(settings.TIME_API, path)
+@backoff
+async def _fetch_time_at(
+    timezone: str, session: "ClientSession", deadline: Optional[float] = None
+) -> Tuple[datetime, Dict[str, Any]]:
+    """Makes a request to get the time at the given timezone."""
+    response = await _make_call(f"/api/timezone/{timezone}", session, deadline)
 
     try:
-        async with session.get(url) as response:
+        return datetime.fromisoformat(response.get("datetime", "")), response
+    except ValueError:
+        raise RetriableError("time is unavailable")
+
+
+async def _make_call(
+    path: str,
+    session: "ClientSession",
+    deadline: Optional[float] = None,
+    cached: bool = False,
+) -> Dict[str, Any]:
+    """Makes a REST GET request to the time API.
+
+    If `TIME_API_MIRROR` is set and `TIME_API` takes longer than
+    `API_HEDGE_DELAY` seconds (or fails), the same request is made to
+    the mirror, and whichever answers first is used.
+
+    Calls fail fast while the circuit breaker is open.
+
+    If cached is set, responses are cached in `http_cache` as their
+    HTTP headers allow. Not meant for responses telling the time, which
+    is outdated as soon as they are received.
+    """
+    if cached:
+        response = http_cache.fresh(urljoin(settings.TIME_API, path))
+        if response is not None:
+            metrics.API_CACHED.inc(result="fresh")
+            return response
+
+    timeout = settings.API_TIMEOUT
+    if deadline:
+        timeout = min(timeout, deadline - asyncio.get_running_loop().time())
+        if timeout <= 0:
+            raise APIError("deadline exceeded")
+
+    if not circuit.allow():
+        raise CircuitOpenError("time service unavailable")
+
+    healthy = False
+    try:
+        with profiling.tracer.span("api", path=path):
+            if settings.TIME_API_MIRROR:
+                response = await _hedged_request(
+                    path, session, timeout, cached, deadline
+                )
+            else:
+                response = await _request(
+                    settings.TIME_API, path, session, timeout, cached
+                )
+        healthy = True
+        return response
+    except UnknownTimezoneError:
+        healthy = True
+        raise
+    finally:
+        circuit.record(healthy)
+
+
+async def _hedged_request(
+    path: str,
+    session: "ClientSession",
+    timeout: float,
+    cached: bool,
+    deadline: Optional[float] = None,
+) -> Dict[str, Any]:
+    loop = asyncio.get_running_loop()
+    request = partial(_request, path=path, session=session, cached=cached)
+    requests = [asyncio.ensure_future(request(settings.TIME_API, timeout=timeout))]
+    requests[0].add_done_callback(_retrieve)
+
+    done, _ = await asyncio.wait(requests, timeout=settings.API_HEDGE_DELAY)
+    if not done or isinstance(requests[0].exception(), RetriableError):
+        metrics.API_HEDGED.inc()
+        # Started later, so the mirror has less time left until the deadline
+        if deadline:
+            timeout = min(timeout, deadline - loop.time())
+        mirror = settings.TIME_API_MIRROR
+        requests.append(asyncio.ensure_future(request(mirror, timeout=timeout)))
+        requests[1].add_done_callback(_retrieve)
+
+    remaining = deadline - loop.time() if deadline else None
+    try:
+        for request in asyncio.as_completed(requests, timeout=remaining):
+            try:
+                return await request
+            except RetriableError as e:
+                error = e
+        raise error
+    except asyncio.TimeoutError:
+        raise RetriableError("timeout error")
+    finally:
+        for request in requests:
+            request.cancel()
+
+
+async def _request(
+    api: str, path: str, session: "ClientSession", timeout: float, cached: bool
+) -> Dict[str, Any]:
+    # Imported on first use, aiohttp takes most of the startup time
+    import aiohttp
+
+    url = urljoin(api, path)
+    headers = http_cache.validators(url) if cached else {}
+
+    try:
+        async with session.get(
+            url, headers=headers, timeout=aiohttp.ClientTimeout(total=timeout)
+        ) as response:
+            if cached and response.status == 304:
+                body = http_cache.revalidate(url, response.headers)
+                if body is None:
+                    raise RetriableError("not modified, but no longer cached")
+                metrics.API_CACHED.inc(result="revalidated")
+                return body
+
             response.raise_for_status()
-            return await response.json()
+            body = await response.json()
+            if cached:
+                http_cache.store(url, response.headers, body)
+            return body
     except (aiohttp.ContentTypeError, json.decoder.JSONDecodeError):
         raise RetriableError("malformed response error")
     except aiohttp.ClientResponseError as e:
         if e.status == 404:
-            raise APIError("unknown timezone")
+            raise UnknownTimezoneError("unknown timezone")
         else:
             raise RetriableError(f"unable to retrieve time (http code: {e.status})")
     except aiohttp.ClientConnectionError:
         raise RetriableError("connection error")
+    except asyncio.TimeoutError:
+        raise RetriableError("timeout error")
+    except RetriableError:
+        raise
     except Exception:
         raise RetriableError("unknown error")
+
+
+def _retrieve(task: asyncio.Future) -> None:
+    # Mark the exception as retrieved, the request may have lost the race
+    if not task.cancelled():
+        task.exception()
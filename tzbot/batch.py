@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import time
+
+from collections import deque
+from typing import Awaitable, Deque, Dict, List, Optional, Tuple
+
+from . import settings
+from .stream import StdioStream
+from .tzbot import TZBot
+
+logger = logging.getLogger("tzbot")
+
+# An answer along with the timezones whose popularity it adds to
+_Answer = Tuple[Optional[str], List[str]]
+
+
+class BatchRunner:
+    r"""Answers every command in a stream in bulk, then exits.
+
+    Commands are answered concurrently, up to `concurrency` at a time,
+    but their answers are written in the same order the commands were
+    read. At most `max_pending` commands are read ahead of the oldest
+    unanswered one, which bounds memory regardless of the input size.
+
+    Identical commands read within `dedup_window` seconds of each other
+    share the same answer, so they are only worked out once. Each one is
+    still counted in the popularity poll, as when answered one by one.
+
+    Arguments:
+
+        bot -- The TZBot answering the commands.
+
+        stream -- A StdioStream from where commands are read and
+            answers written.
+
+        concurrency -- Defaults to `settings.BATCH_CONCURRENCY`.
+
+        max_pending -- Defaults to `settings.BATCH_MAX_PENDING`.
+
+        dedup_window -- Defaults to `settings.BATCH_DEDUP_WINDOW`.
+    """
+
+    def __init__(
+        self,
+        bot: TZBot,
+        stream: StdioStream,
+        concurrency: Optional[int] = None,
+        max_pending: Optional[int] = None,
+        dedup_window: Optional[float] = None,
+    ) -> None:
+        self.bot, self.stream = bot, stream
+        self.concurrency = concurrency or settings.BATCH_CONCURRENCY
+        self.max_pending = max_pending or settings.BATCH_MAX_PENDING
+        self.dedup_window = (
+            settings.BATCH_DEDUP_WINDOW if dedup_window is None else dedup_window
+        )
+        self.slots = asyncio.Semaphore(self.concurrency)
+        self.pending: Deque[Tuple[str, asyncio.Future]] = deque()
+        self.answers: Dict[Tuple[str, ...], Tuple[float, asyncio.Future]] = {}
+        self.commands = self.answered = self.deduplicated = 0
+
+    async def run(self) -> None:
+        """Answers every command in the stream until EOF."""
+        started_at = time.monotonic()
+
+        async with self.bot.started():
+            while True:
+                try:
+                    nick, cmd, args = await self.stream.read_command()
+                except EOFError:
+                    break
+
+                self.commands += 1
+                self.pending.append((nick, self._answer(cmd, args)))
+                await self._write_answers(block=len(self.pending) >= self.max_pending)
+
+            while self.pending:
+                await self._write_answers(block=True)
+
+        elapsed = time.monotonic() - started_at
+        logger.info(
+            f"Batch: answered {self.answered} of {self.commands} commands "
+            f"({self.deduplicated} deduplicated) in {elapsed:.2f} s, "
+            f"{self.commands / max(elapsed, 1e-9):.0f} commands/s"
+        )
+
+    def _answer(self, cmd: str, args: List[str]) -> asyncio.Future:
+        now = time.monotonic()
+        key = (cmd, *args)
+        expires_at, answer = self.answers.get(key, (0, None))
+
+        if answer is not None and now < expires_at:
+            self.deduplicated += 1
+        else:
+            if len(self.answers) >= self.max_pending:
+                # Forget about answers that can't be shared anymore
+                self.answers = {k: v for k, v in self.answers.items() if now < v[0]}
+
+            answer = asyncio.ensure_future(self._limited(self.bot.answer(cmd, args)))
+            self.answers[key] = (now + self.dedup_window, answer)
+
+        return asyncio.ensure_future(self._counted(answer))
+
+    async def _limited(self, answer: Awaitable[_Answer]) -> _Answer:
+        async with self.slots:
+            return await answer
+
+    async def _counted(self, answer: Awaitable[_Answer]) -> Optional[str]:
+        """Counts a command sharing answer in the popularity poll."""
+        message, told = await answer
+        for tz in told:
+            self.bot.poll.increment_popularity_of(tz)
+        return message
+
+    async def _write_answers(self, block: bool) -> None:
+        """Writes the answers ready at the head of the pending commands.
+
+        If block is set, it waits for at least the oldest one.
+        """
+        while self.pending and (block or self.pending[0][1].done()):
+            nick, answer = self.pending.popleft()
+            block = False
+
+            try:
+                message = await answer
+            except Exception:
+                logger.exception("Unexpected error while answering a command")
+                continue
+
+            if message:
+                self.answered += 1
+                await self.stream.send_message(nick, message)
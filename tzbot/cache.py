@@ -0,0 +1,50 @@
+import time
+
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional, Tuple
+
+from . import settings
+
+
+class ResponseCache:
+    r"""Caches the answers for timezones until the minute they show ends.
+
+    Answers only show the time up to minutes, so every answer for the
+    same timezone within a minute is the same. Only the last `size`
+    used timezones are kept.
+
+    Arguments:
+
+        size -- Maximum number of answers kept. Defaults to
+            `settings.RESPONSE_CACHE_SIZE`.
+    """
+
+    def __init__(self, size: Optional[int] = None) -> None:
+        self.size = settings.RESPONSE_CACHE_SIZE if size is None else size
+        self.answers: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self.hits = self.misses = 0
+
+    def get(self, timezone: str) -> Optional[str]:
+        """Returns the cached answer for timezone, if still current."""
+        entry = self.answers.get(timezone)
+
+        if entry is None or time.monotonic() >= entry[0]:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.answers.move_to_end(timezone)
+        return entry[1]
+
+    def put(self, timezone: str, answer: str, tztime: datetime) -> None:
+        """Caches the answer for timezone, given the time it shows."""
+        if self.size <= 0:
+            return
+
+        until_next_minute = 60 - tztime.second - tztime.microsecond / 1e6
+        self.answers[timezone] = (time.monotonic() + until_next_minute, answer)
+        self.answers.move_to_end(timezone)
+
+        while len(self.answers) > self.size:
+            self.answers.popitem(last=False)
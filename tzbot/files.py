@@ -0,0 +1,44 @@
+import json
+import logging
+import os
+
+from typing import Any, Callable, TextIO
+
+logger = logging.getLogger("tzbot")
+
+
+def write_atomically(filename: str, write: Callable[[TextIO], None]) -> None:
+    """Writes a file through write, whole or not at all.
+
+    It's written to `<filename>.tmp` and synced to disk first, then moved
+    over filename, so crashing halfway leaves the previous file as it was.
+    """
+    partial_filename = f"{filename}.tmp"
+    with open(partial_filename, "w") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(partial_filename, filename)
+
+
+def read_json(filename: str, what: str) -> Any:
+    """Returns the JSON object in a file, or an empty one if unreadable.
+
+    Any failure besides a missing file is logged as reading what.
+    """
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning(f"Couldn't read {what}: {str(e)}")
+        return {}
+
+
+def write_json(filename: str, value: Any, what: str) -> None:
+    """Writes value to a file as JSON atomically, logging failures as writing what."""
+    try:
+        write_atomically(filename, lambda f: json.dump(value, f, separators=(",", ":")))
+    except OSError as e:
+        logger.error(f"Couldn't write {what}: {str(e)}")
@@ -0,0 +1,150 @@
+import asyncio
+import time
+
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Mapping, NamedTuple, Optional
+
+from . import files
+from . import settings
+
+
+class CachedResponse(NamedTuple):
+    """A response body, its validators and until when it's fresh."""
+
+    body: Any
+    etag: Optional[str]
+    last_modified: Optional[str]
+    expires_at: float
+
+
+class HTTPCache:
+    r"""Caches HTTP responses as told by their headers.
+
+    Responses are fresh for as long as `Cache-Control: max-age` (or
+    else `Expires`) says, and can be used without a request meanwhile.
+    Once stale, their `ETag` and `Last-Modified` are sent along with the
+    next request, so an unchanged response costs a 304 rather than the
+    whole body again. `Cache-Control: no-store` responses aren't kept.
+
+    Only the last `size` used responses are kept. If a file is given,
+    they are loaded from it on open and saved to it on close.
+
+    Arguments:
+
+        filename -- JSON file where the responses are kept. Defaults to
+            `settings.HTTP_CACHE_FILENAME`. In memory only if None.
+
+        size -- Defaults to `settings.HTTP_CACHE_SIZE`.
+    """
+
+    def __init__(self, filename: Optional[str] = None, size: Optional[int] = None):
+        self.filename = filename
+        self.size = size or settings.HTTP_CACHE_SIZE
+        self.responses: "OrderedDict[str, CachedResponse]" = OrderedDict()
+
+    async def open(self) -> None:
+        """Loads the responses saved to the file, if any."""
+        self.filename = self.filename or settings.HTTP_CACHE_FILENAME
+        if not self.filename:
+            return
+
+        loop = asyncio.get_running_loop()
+        responses = await loop.run_in_executor(None, self._read)
+        for url, response in responses.items():
+            self.responses[url] = CachedResponse(*response)
+
+    async def close(self) -> None:
+        """Saves the responses to the file, if any."""
+        if not self.filename:
+            return
+
+        responses = {url: list(response) for url, response in self.responses.items()}
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._write, responses)
+
+    def fresh(self, url: str) -> Optional[Any]:
+        """Returns the body of the response for url, if still fresh."""
+        response = self.responses.get(url)
+        if response is None or time.time() >= response.expires_at:
+            return None
+
+        self.responses.move_to_end(url)
+        return response.body
+
+    def validators(self, url: str) -> Dict[str, str]:
+        """Returns the headers making the request for url conditional."""
+        response = self.responses.get(url)
+        headers = {}
+        if response and response.etag:
+            headers["If-None-Match"] = response.etag
+        if response and response.last_modified:
+            headers["If-Modified-Since"] = response.last_modified
+        return headers
+
+    def store(self, url: str, headers: Mapping[str, str], body: Any) -> None:
+        """Caches a response, unless its headers don't allow it."""
+        expires_at = _expires_at(headers)
+        etag, last_modified = headers.get("ETag"), headers.get("Last-Modified")
+        stale = expires_at is not None and expires_at <= time.time()
+
+        # Useless if it's stale and can't be revalidated either
+        if expires_at is None or (stale and not (etag or last_modified)):
+            self.responses.pop(url, None)
+            return
+
+        self.responses[url] = CachedResponse(body, etag, last_modified, expires_at)
+        self.responses.move_to_end(url)
+        while len(self.responses) > self.size:
+            self.responses.popitem(last=False)
+
+    def revalidate(self, url: str, headers: Mapping[str, str]) -> Optional[Any]:
+        """Returns the body of the response for url after a 304.
+
+        Its freshness is updated from the headers of the 304 response.
+        Returns None if there is no response for url anymore.
+        """
+        response = self.responses.get(url)
+        if response is None:
+            return None
+
+        expires_at = _expires_at(headers)
+        if expires_at is not None:
+            self.responses[url] = response._replace(expires_at=expires_at)
+        self.responses.move_to_end(url)
+        return response.body
+
+    def _read(self) -> Dict[str, list]:
+        return files.read_json(self.filename, "the HTTP cache")
+
+    def _write(self, responses: Dict[str, list]) -> None:
+        files.write_json(self.filename, responses, "the HTTP cache")
+
+
+def _expires_at(headers: Mapping[str, str]) -> Optional[float]:
+    """Returns until when a response is fresh, or None if it can't be kept."""
+    now = time.time()
+    directives = {}
+    for directive in headers.get("Cache-Control", "").split(","):
+        name, _, value = directive.strip().partition("=")
+        directives[name.lower()] = value.strip('"')
+
+    if "no-store" in directives:
+        return None
+    if "no-cache" in directives:
+        return now
+
+    if "max-age" in directives:
+        try:
+            age = int(headers.get("Age", 0))
+            return now + int(directives["max-age"]) - age
+        except ValueError:
+            return now
+
+    if "Expires" in headers:
+        try:
+            return parsedate_to_datetime(headers["Expires"]).timestamp()
+        except (TypeError, ValueError):
+            return now
+
+    return now
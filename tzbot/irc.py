@@ -0,0 +1,92 @@
+import re
+
+from typing import Dict, List, Optional, Tuple
+
+# [@tags] [:prefix] command [params...] [:trailing]
+_MESSAGE_REGEX = re.compile(
+    rb"(?:@(?P<tags>\S+) +)?"
+    rb"(?::(?P<prefix>\S+) +)?"
+    rb"(?P<command>[^:\s]\S*)"
+    rb"(?P<params>(?: +[^:\s]\S*)*)"
+    rb"(?: +:(?P<trailing>.*))? *"
+)
+_BOT_COMMAND_REGEX = re.compile(r"\s*(!timeat|!timepopularity) (.+)")
+_TAG_ESCAPES = {":": ";", "s": " ", "\\": "\\", "r": "\r", "n": "\n"}
+_TAG_ESCAPE_REGEX = re.compile(r"\\(.?)")
+
+# Every bot command contains it. Checking for it is enough to discard
+# most lines without parsing them
+BOT_COMMAND_MARKER = "!time"
+
+
+class Message:
+    """A message as received from an IRC server."""
+
+    __slots__ = ("tags", "prefix", "command", "params")
+
+    def __init__(
+        self,
+        command: str,
+        params: List[str],
+        prefix: Optional[str] = None,
+        tags: Optional[Dict[str, str]] = None,
+    ) -> None:
+        self.command, self.params = command, params
+        self.prefix, self.tags = prefix, tags or {}
+
+    @property
+    def nick(self) -> Optional[str]:
+        """The nick of the user that sent the message, if sent by one."""
+        if self.prefix is None or "!" not in self.prefix:
+            return None
+        return self.prefix.split("!", 1)[0]
+
+    @property
+    def trailing(self) -> Optional[str]:
+        return self.params[-1] if self.params else None
+
+    def __repr__(self) -> str:
+        return (
+            f"Message({self.command!r}, {self.params!r}, "
+            f"prefix={self.prefix!r}, tags={self.tags!r})"
+        )
+
+
+def parse_message(line: bytes) -> Optional[Message]:
+    """Parses a raw IRC line, without the trailing CRLF, in a single pass."""
+    m = _MESSAGE_REGEX.fullmatch(line)
+    if m is None:
+        return None
+
+    tags, prefix, command, params, trailing = m.groups()
+    params = params.decode(errors="replace").split()
+    if trailing is not None:
+        params.append(trailing.decode(errors="replace"))
+
+    return Message(
+        command.decode(errors="replace").upper(),
+        params,
+        prefix.decode(errors="replace") if prefix else None,
+        _parse_tags(tags.decode(errors="replace")) if tags else None,
+    )
+
+
+def parse_bot_command(text: str) -> Optional[Tuple[str, List[str]]]:
+    """Parses a bot command (e.g. `!timeat <tzinfo>`) and its arguments."""
+    if BOT_COMMAND_MARKER not in text:
+        return None
+
+    m = _BOT_COMMAND_REGEX.fullmatch(text)
+    return (m[1], m[2].split()) if m else None
+
+
+def _parse_tags(tags: str) -> Dict[str, str]:
+    """Parses the IRCv3 message tags (`key=value;key;...`)."""
+    parsed = {}
+    for tag in tags.split(";"):
+        key, _, value = tag.partition("=")
+        if key:
+            parsed[key] = _TAG_ESCAPE_REGEX.sub(
+                lambda m: _TAG_ESCAPES.get(m[1], m[1]), value
+            )
+    return parsed
@@ -1,16 +1,122 @@
+import atexit
+import json
 import logging
+import queue
+import random
 import sys
 
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
 
-def setup_logger(name):
-    logging.basicConfig(
-        format="%(asctime)s [%(levelname)s -- %(filename)s(%(funcName)s:%(lineno)s)]: %(message)s",
-        level=logging.DEBUG,
-        datefmt="%H:%M:%S",
-        stream=sys.stderr,
-    )
+from . import settings
+
+TEXT_FORMAT = "%(asctime)s [%(levelname)s -- %(name)s]: %(message)s"
+DEBUG_FORMAT = (
+    "%(asctime)s [%(levelname)s -- %(filename)s(%(funcName)s:%(lineno)s)]: "
+    "%(message)s"
+)
+DATE_FORMAT = "%H:%M:%S"
+
+_listener: Optional[QueueListener] = None
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats every record as a JSON object on a line of its own."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+class SamplingFilter(logging.Filter):
+    """Lets a random fraction of the records through, dropping the rest."""
+
+    def __init__(self, rate: float) -> None:
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return self.rate >= 1 or random.random() < self.rate
+
+
+class _DeferredQueueHandler(QueueHandler):
+    # QueueHandler formats the message before queueing it, on the thread
+    # logging. Leave it to the listener instead, as nothing is pickled
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def setup_logger(
+    name: str,
+    level: Optional[str] = None,
+    json_output: Optional[bool] = None,
+    sample_rates: Optional[Dict[str, float]] = None,
+) -> logging.Logger:
+    """Sends every log through a queue to a stderr writing thread.
+
+    Logging only queues the records, so a slow stderr doesn't stall the
+    event loop, and they are formatted as text or JSON by the thread.
+    Per-command logs go to a logger per category under name (e.g.
+    `tzbot.commands`), of which only a fraction is kept if sampled.
+
+    Arguments default to `settings.LOG_LEVEL`, `settings.LOG_JSON` and
+    `settings.LOG_SAMPLE_RATES`. Calling it again replaces the setup.
+    """
+    global _listener
+
+    level = level or settings.LOG_LEVEL
+    json_output = settings.LOG_JSON if json_output is None else json_output
+    sample_rates = settings.LOG_SAMPLE_RATES if sample_rates is None else sample_rates
+    debug = logging.getLevelName(level) <= logging.DEBUG
+
+    handler = logging.StreamHandler(sys.stderr)
+    if json_output:
+        handler.setFormatter(JSONFormatter())
+    else:
+        handler.setFormatter(
+            logging.Formatter(DEBUG_FORMAT if debug else TEXT_FORMAT, DATE_FORMAT)
+        )
+
+    shutdown()
+    root = logging.getLogger()
+    for previous in root.handlers[:]:
+        if isinstance(previous, _DeferredQueueHandler):
+            root.removeHandler(previous)
+
+    records = queue.SimpleQueue()
+    root.addHandler(_DeferredQueueHandler(records))
+    root.setLevel(level)
+    _listener = QueueListener(records, handler)
+    _listener.start()
 
     # Bump the logging level of asyncio
     logging.getLogger("asyncio").setLevel(logging.WARNING)
 
-    return logging.getLogger("tzbot")
+    for category, rate in sample_rates.items():
+        category_logger = logging.getLogger(f"{name}.{category}")
+        for previous in category_logger.filters[:]:
+            category_logger.removeFilter(previous)
+        category_logger.addFilter(SamplingFilter(rate))
+        # Don't even create the records if none is kept
+        category_logger.setLevel(logging.CRITICAL + 1 if rate <= 0 else logging.NOTSET)
+
+    return logging.getLogger(name)
+
+
+def shutdown() -> None:
+    """Writes the logs still queued and stops the writing thread."""
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(shutdown)
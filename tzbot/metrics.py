@@ -0,0 +1,232 @@
+import bisect
+import time
+
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from . import settings
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (
+    0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30
+)  # fmt: skip
+
+REGISTRY: List["Metric"] = []
+
+
+class Metric:
+    r"""Base class of the metrics exposed in the Prometheus text format.
+
+    Metrics register themselves on creation. Values are kept per label
+    values, given as keyword arguments when updating the metric.
+
+    Arguments:
+
+        name -- Name of the metric.
+
+        help -- Description of the metric.
+
+        labels -- Names of the labels the metric is split by.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()) -> None:
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        REGISTRY.append(self)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def _format_labels(self, values: LabelValues, **extra: str) -> str:
+        pairs = list(zip(self.labels, values)) + list(extra.items())
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class Counter(Metric):
+    """A value that only goes up."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()) -> None:
+        super().__init__(name, help, labels)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        return super().render() + [
+            f"{self.name}{self._format_labels(key)} {value}"
+            for key, value in self.values.items()
+        ]
+
+
+class Gauge(Metric):
+    """A value that goes up and down, read from a function when rendered."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str) -> None:
+        super().__init__(name, help)
+        self.function: Optional[Callable[[], float]] = None
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self.function = function
+
+    def render(self) -> List[str]:
+        if self.function is None:
+            return []
+        return super().render() + [f"{self.name} {self.function()}"]
+
+
+class CounterFunction(Gauge):
+    """A counter read from a function when rendered."""
+
+    kind = "counter"
+
+
+class Histogram(Metric):
+    """Counts observations (e.g. latencies, in seconds) into buckets."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        # Per label values: a count per bucket (plus +Inf), sum and count
+        self.values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        if key not in self.values:
+            self.values[key] = ([0] * (len(self.buckets) + 1), [0.0, 0])
+        counts, totals = self.values[key]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        totals[0] += value
+        totals[1] += 1
+
+    def time(self, **labels: str) -> "_Timer":
+        """Observes the seconds spent in the block."""
+        return _Timer(self, labels)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for key, (counts, (total, count)) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip([*self.buckets, "+Inf"], counts):
+                cumulative += bucket_count
+                labels = self._format_labels(key, le=str(bound))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {count}")
+        return lines
+
+
+class _Timer:
+    # A plain class rather than @contextmanager, it's used on every command
+    __slots__ = ("histogram", "labels", "started_at")
+
+    def __init__(self, histogram: Histogram, labels: Dict[str, str]) -> None:
+        self.histogram, self.labels = histogram, labels
+
+    def __enter__(self) -> None:
+        self.started_at = time.perf_counter()
+
+    def __exit__(self, *exc_info) -> None:
+        elapsed = time.perf_counter() - self.started_at
+        self.histogram.observe(elapsed, **self.labels)
+
+
+def render() -> str:
+    """Renders every registered metric in the Prometheus text format."""
+    return "".join(line + "\n" for metric in REGISTRY for line in metric.render())
+
+
+async def serve(host: Optional[str] = None, port: Optional[int] = None):
+    """Serves the metrics over HTTP at `/metrics`.
+
+    Returns the aiohttp runner, to be cleaned up once done.
+    """
+    from aiohttp import web
+
+    async def handler(request: web.Request) -> web.Response:
+        return web.Response(
+            body=render().encode(),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(
+        runner, host or settings.METRICS_HOST, port or settings.METRICS_PORT
+    )
+    await site.start()
+    return runner
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+COMMANDS_RECEIVED = Counter(
+    "tzbot_commands_received_total", "Commands read from the streams", ["command"]
+)
+COMMANDS_IGNORED = Counter(
+    "tzbot_commands_ignored_total", "Commands not supported or with wrong arguments"
+)
+COMMANDS_REJECTED = Counter(
+    "tzbot_commands_rejected_total",
+    "Commands dropped before being queued, per reason",
+    labels=("reason",),
+)
+COMMANDS_SHED = CounterFunction(
+    "tzbot_commands_shed_total", "Commands dropped while queued, or as queue was full"
+)
+COMMAND_LATENCY = Histogram(
+    "tzbot_command_latency_seconds",
+    "Time spent per command and stage (parse, alias, api, poll, send, total)",
+    ["stage"],
+)
+API_RETRIES = Counter(
+    "tzbot_api_retries_total", "Time API calls retried, by error", ["error"]
+)
+API_CACHED = Counter(
+    "tzbot_api_cached_total",
+    "Time API calls answered from the HTTP cache, fresh or revalidated",
+    ["result"],
+)
+API_HEDGED = Counter(
+    "tzbot_api_hedged_total", "Time API requests repeated to the mirror"
+)
+API_CIRCUIT_OPEN = Gauge(
+    "tzbot_api_circuit_open", "Whether calls to the time API are failing fast"
+)
+API_COALESCED = CounterFunction(
+    "tzbot_api_coalesced_total", "Time lookups answered by an identical one in flight"
+)
+RESPONSE_CACHE_HITS = CounterFunction(
+    "tzbot_response_cache_hits_total", "Timezones answered from the response cache"
+)
+RESPONSE_CACHE_MISSES = CounterFunction(
+    "tzbot_response_cache_misses_total", "Timezones not in the response cache"
+)
+TASKS_IN_FLIGHT = Gauge("tzbot_tasks_in_flight", "Commands being processed")
+TASKS_QUEUED = Gauge("tzbot_tasks_queued", "Commands waiting to be processed")
+IRC_QUEUE_LATENCY = Histogram(
+    "tzbot_irc_queue_latency_seconds", "Time messages wait to be sent to IRC"
+)
@@ -0,0 +1,146 @@
+from datetime import datetime, timedelta, timezone as fixed_timezone
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:  # Python < 3.9
+    ZoneInfo = None
+
+from . import settings
+
+
+class ZoneOffset(NamedTuple):
+    """A UTC offset and the instant (in UTC) until which it holds."""
+
+    tzinfo: fixed_timezone
+    valid_until: datetime
+
+
+class OffsetCache:
+    r"""Tells the time at a timezone from its cached UTC offset.
+
+    The time API responses include the UTC offset of the timezone and,
+    while DST is in effect, the instant it ends at. Given that, the
+    time can be computed locally until the offset changes, rather than
+    asked to the API for every request.
+
+    Offsets are trusted until the next known DST transition, and never
+    for longer than `OFFSET_CACHE_TTL` seconds, as the API doesn't
+    announce when DST starts. Timezones in the local timezone database
+    are trusted only until their next offset change in it, if sooner.
+
+    Arguments:
+
+        ttl -- Maximum number of seconds an offset is trusted for.
+            Defaults to `settings.OFFSET_CACHE_TTL`.
+    """
+
+    def __init__(self, ttl: Optional[float] = None) -> None:
+        ttl = settings.OFFSET_CACHE_TTL if ttl is None else ttl
+        self.ttl = timedelta(seconds=ttl)
+        self.offsets: Dict[str, ZoneOffset] = {}
+
+    def time_at(self, timezone: str) -> Optional[datetime]:
+        """Returns the time at timezone if its offset is known and valid."""
+        offset = self.offsets.get(timezone)
+        now = _utcnow()
+
+        if offset is None or now >= offset.valid_until:
+            return None
+
+        return now.astimezone(offset.tzinfo)
+
+    def update(self, timezone: str, response: Dict[str, Any]) -> None:
+        """Caches the offset of timezone given a time API response."""
+        try:
+            tzinfo = fixed_timezone(_parse_utc_offset(response["utc_offset"]))
+        except (KeyError, TypeError, ValueError):
+            return
+
+        now = _utcnow()
+        valid_until = _next_offset_change(timezone, now, now + self.ttl)
+        if response.get("dst_until"):
+            try:
+                dst_until = datetime.fromisoformat(response["dst_until"])
+            except (TypeError, ValueError):
+                pass
+            else:
+                valid_until = min(valid_until, dst_until)
+
+        self.offsets[timezone] = ZoneOffset(tzinfo, valid_until)
+
+    def expiring(self, within: float = 0) -> List[str]:
+        """Returns the timezones whose offset expires within some seconds."""
+        until = _utcnow() + timedelta(seconds=within)
+        return [tz for tz, entry in self.offsets.items() if entry.valid_until <= until]
+
+    def snapshot(self) -> Dict[str, Tuple[float, float]]:
+        """Returns the offsets as seconds east of UTC and expiration timestamps."""
+        return {
+            tz: (tzinfo.utcoffset(None).total_seconds(), valid_until.timestamp())
+            for tz, (tzinfo, valid_until) in self.offsets.items()
+        }
+
+    def restore(self, snapshot: Dict[str, Tuple[float, float]]) -> None:
+        """Caches the offsets of a snapshot, unless already known."""
+        for tz, (seconds, valid_until) in snapshot.items():
+            if tz not in self.offsets:
+                self.offsets[tz] = ZoneOffset(
+                    fixed_timezone(timedelta(seconds=seconds)),
+                    datetime.fromtimestamp(valid_until, fixed_timezone.utc),
+                )
+
+    def local_time_at(self, timezone: str) -> Optional[datetime]:
+        """Returns the time at timezone without the help of the time API.
+
+        The local timezone database is checked first. If the timezone
+        is missing from it, the last offset seen for it is used
+        regardless of its expiration.
+        """
+        if ZoneInfo is not None:
+            try:
+                return _utcnow().astimezone(ZoneInfo(timezone))
+            except (KeyError, ValueError, OSError):
+                pass
+
+        offset = self.offsets.get(timezone)
+        return _utcnow().astimezone(offset.tzinfo) if offset else None
+
+
+def _next_offset_change(timezone: str, start: datetime, end: datetime) -> datetime:
+    """Returns when the offset of timezone changes after start, if before end.
+
+    Only the offsets at both ends are compared, so a change undone before
+    end is missed. Otherwise (or if the timezone isn't known locally),
+    end is returned.
+    """
+    if ZoneInfo is None:
+        return end
+    try:
+        zone = ZoneInfo(timezone)
+    except (KeyError, ValueError, OSError):
+        return end
+
+    offset = start.astimezone(zone).utcoffset()
+    if end.astimezone(zone).utcoffset() == offset:
+        return end
+
+    # Narrow it down to the last second at the offset of start
+    while end - start > timedelta(seconds=1):
+        middle = start + (end - start) / 2
+        if middle.astimezone(zone).utcoffset() == offset:
+            start = middle
+        else:
+            end = middle
+    return start
+
+
+def _parse_utc_offset(utc_offset: str) -> timedelta:
+    """Parses an offset with the `+HH:MM` format."""
+    sign = -1 if utc_offset[0] == "-" else 1
+    hours, minutes = utc_offset.lstrip("+-").split(":")
+    return sign * timedelta(hours=int(hours), minutes=int(minutes))
+
+
+def _utcnow() -> datetime:
+    return datetime.now(fixed_timezone.utc)
@@ -1,30 +1,195 @@
 import asyncio
-import shelve
+import logging
 
+from bisect import bisect_left, insort
+from typing import Dict, List, Optional, Tuple
+
+from . import profiling
 from . import settings
 from . import utils
+from .pollstore import PollStore
+from .window import SlidingWindow
+
+logger = logging.getLogger("tzbot")
+
+
+class _Node:
+    __slots__ = ("count", "own", "ranking", "children")
+
+    def __init__(self) -> None:
+        self.count = 0
+        # Requests for this very timezone, rather than under it
+        self.own = 0
+        # (-count, timezone) of every timezone under it, most requested first
+        self.ranking: List[Tuple[int, str]] = []
+        self.children: Dict[str, "_Node"] = {}
+
+
+class PopularityPoll:
+    r"""Keeps count of the `!timeat` requests received per timezone prefix.
+
+    Counts are kept in memory in a trie with a node per '/' delimited
+    token, so updating or querying a timezone only walks its prefixes.
+    Every node also keeps the timezones under it sorted by count, so
+    the most requested ones under a prefix are at hand.
+
+    Requests within each of `settings.POPULARITY_WINDOWS` (e.g. the
+    last hour) are counted per prefix in sliding windows. These are
+    only counted in memory, since the poll was created.
+
+    Increments are written behind to a `PollStore` in batches by a
+    single writer, every `POLL_FLUSH_INTERVAL` seconds and when the
+    poll is closed. Every write also merges the increments written by
+    other processes sharing the store, and the counts are reloaded
+    from the merged view.
+
+    Arguments:
+
+        filename -- Prefix of the files where counts are persisted.
+            Defaults to `settings.POLL_FILENAME`.
+    """
+
+    def __init__(self, filename: Optional[str] = None) -> None:
+        self.filename = filename or settings.POLL_FILENAME
+        self.store = PollStore(self.filename)
+        self.root = _Node()
+        self.windows = {
+            name: SlidingWindow(span, buckets)
+            for name, (span, buckets) in settings.POPULARITY_WINDOWS.items()
+        }
+        # Increments per timezone not written to the store yet
+        self.pending: Dict[str, int] = {}
+        self.flusher = None
+        self.writing = None
+
+    async def open(self) -> None:
+        """Loads the persisted counts and starts flushing periodically."""
+        loop = asyncio.get_running_loop()
+        self.root = await loop.run_in_executor(None, self._load)
+        self.flusher = asyncio.create_task(self._flush_periodically())
+
+    async def close(self) -> None:
+        """Stops flushing periodically and writes the pending increments."""
+        if self.flusher:
+            self.flusher.cancel()
+            try:
+                await self.flusher
+            except asyncio.CancelledError:
+                pass
+            self.flusher = None
+
+        await self.flush(close=True)
+
+    def increment_popularity_of(self, timezone: str) -> None:
+        """Updates the number of requests received for every prefix of timezone."""
+        _add(self.root, timezone, 1)
+        self.pending[timezone] = self.pending.get(timezone, 0) + 1
+
+        prefixes = list(utils.tz_prefixes(timezone))
+        for window in self.windows.values():
+            window.add(prefixes)
+
+    def get_popularity_of(self, timezone: str, window: Optional[str] = None) -> int:
+        """Retrieves the number of requests received for timezones with the given prefix.
+
+        If a window is given (e.g. `hour`), only those received within it.
+        """
+        if window is not None:
+            return self.windows[window].count(timezone)
+
+        node = self._node(timezone)
+        return node.count if node else 0
+
+    def get_top_of(self, prefix: str, amount: int) -> List[Tuple[str, int]]:
+        """Retrieves the most requested timezones under prefix, and their counts."""
+        node = self._node(prefix)
+        if node is None:
+            return []
+        return [(timezone, -count) for count, timezone in node.ranking[:amount]]
+
+    async def flush(self, close: bool = False) -> None:
+        """Writes the pending increments and reloads the merged counts.
+
+        If closing, the increments are merged for good.
+        """
+        # Wait for an ongoing write so there is a single writer at a time
+        while self.writing is not None:
+            await asyncio.wait([self.writing])
+
+        pending, self.pending = self.pending, {}
+
+        def blocking_func():
+            with profiling.tracer.span("poll.store", timezones=len(pending)):
+                if pending:
+                    self.store.append(pending)
+                return self._load(close)
+
+        loop = asyncio.get_running_loop()
+        with profiling.tracer.span("poll.flush"):
+            self.writing = loop.run_in_executor(None, blocking_func)
+            self.writing.add_done_callback(lambda f: self._written(f, pending))
+            await asyncio.wait([self.writing])
+
+    def _written(self, future: asyncio.Future, pending: Dict[str, int]) -> None:
+        self.writing = None
+
+        if future.exception():
+            logger.error(f"Couldn't write the popularity poll: {future.exception()}")
+            # Keep the increments around for the next flush
+            for timezone, increment in pending.items():
+                self.pending[timezone] = self.pending.get(timezone, 0) + increment
+            return
 
+        # Counted in the store now, except those received meanwhile
+        self.root = future.result()
+        for timezone, increment in self.pending.items():
+            _add(self.root, timezone, increment)
 
-async def increment_popularity_of(timezone: str) -> None:
-    """Updates the number of requests received for every prefix of timezone."""
+    def _load(self, close: bool = False) -> _Node:
+        """Builds the trie of the counts merged in the store."""
+        root = _Node()
+        for timezone, count in self.store.compact(close).items():
+            _add(root, timezone, count)
+        return root
 
-    def blocking_func():
-        with shelve.open(settings.POLL_FILENAME) as poll:
-            for prefix in utils.tz_prefixes(timezone):
-                if prefix not in poll:
-                    poll[prefix] = 0
-                poll[prefix] += 1
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(settings.POLL_FLUSH_INTERVAL)
+            await self.flush()
 
-    loop = asyncio.get_running_loop()
-    await loop.run_in_executor(None, blocking_func)
+    def _node(self, timezone: str) -> Optional[_Node]:
+        node = self.root
+        for token in timezone.split("/"):
+            if token not in node.children:
+                return None
+            node = node.children[token]
+        return node
 
 
-async def get_popularity_of(timezone: str) -> int:
-    """Retrieves the number of requests received for timezones with the given prefix."""
+def _add(root: _Node, timezone: str, count: int) -> None:
+    """Adds count to every prefix of timezone in the trie under root."""
+    node, path = root, []
+    for token in timezone.split("/"):
+        child = node.children.get(token)
+        if child is None:
+            child = node.children[token] = _Node()
+        node = child
+        node.count += count
+        path.append(node)
 
-    def blocking_func():
-        with shelve.open(settings.POLL_FILENAME) as poll:
-            return poll[timezone] if timezone in poll else 0
+    # Move the timezone up the ranking of every prefix
+    previous, node.own = node.own, node.own + count
+    entry = (-node.own, timezone)
+    for prefix in path:
+        ranking = prefix.ranking
+        if not previous:
+            insort(ranking, entry)
+            continue
 
-    loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(None, blocking_func)
+        index = bisect_left(ranking, (-previous, timezone))
+        if index == 0 or ranking[index - 1] < entry:
+            # Still in order, as it usually is for the most requested
+            ranking[index] = entry
+        else:
+            del ranking[index]
+            insort(ranking, entry, hi=index)
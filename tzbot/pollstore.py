@@ -0,0 +1,184 @@
+import fcntl
+import glob
+import json
+import logging
+import mmap
+import os
+
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, TextIO, Tuple
+
+from . import files
+from . import settings
+
+logger = logging.getLogger("tzbot")
+
+SEGMENT_SUFFIX = ".segment"
+
+
+class PollStore:
+    r"""Keeps the number of requests per timezone, shared between processes.
+
+    Every store appends its increments to a segment file of its own as
+    `<count>\t<timezone>` lines, so processes never write to the same
+    file and appending needs no lock. A compactor merges the segments
+    into a snapshot, along with up to which offset each was merged, and
+    replaces the previous snapshot at once. Readers only ever see a
+    whole snapshot, which is read through mmap.
+
+    Compactions hold an exclusive lock on `<filename>.lock`, so a single
+    process compacts at a time. Closing a store merges its segment and
+    removes it, as does compacting once it's `segment_size` bytes long,
+    carrying on with a new segment.
+
+    A snapshot that can't be read (e.g. left empty by a crash) is
+    logged and ignored, and the segments left are merged again.
+
+    A shelve file left at filename by an older version of the poll is
+    migrated into the snapshot on the first compaction.
+
+    Arguments:
+
+        filename -- Prefix of the snapshot, lock and segment files.
+
+        segment_size -- Defaults to `settings.POLL_SEGMENT_SIZE`.
+    """
+
+    def __init__(self, filename: str, segment_size: Optional[int] = None) -> None:
+        self.filename = filename
+        self.snapshot = f"{filename}.snapshot"
+        self.segment_size = segment_size or settings.POLL_SEGMENT_SIZE
+        self.segment = self._new_segment()
+
+    def append(self, counts: Dict[str, int]) -> None:
+        """Appends increments per timezone to the segment of this store."""
+        records = "".join(f"{count}\t{tz}\n" for tz, count in counts.items())
+        # A single write, so a crash can only leave the last line incomplete
+        with open(self.segment, "ab") as f:
+            f.write(records.encode())
+
+    def compact(self, close: bool = False) -> Dict[str, int]:
+        """Merges every segment into the snapshot and returns its counts.
+
+        If closing, the segment of this store is removed once merged.
+        """
+        with self._locked():
+            merged, counts = self._read_snapshot()
+            if not os.path.exists(self.snapshot) and _has_shelve(self.filename):
+                counts = _migrate_shelve(self.filename)
+
+            segments = {}
+            pattern = glob.escape(self.filename) + ".*" + SEGMENT_SUFFIX
+            for path in glob.glob(pattern):
+                name = os.path.basename(path)
+                segments[name] = _merge_segment(path, merged.get(name, 0), counts)
+            # Offsets of the segments removed since are forgotten too
+            changed = segments != merged or not os.path.exists(self.snapshot)
+            own = os.path.basename(self.segment)
+            # Only this store appends to it, so it's merged whole by now
+            roll_over = close or segments.get(own, 0) >= self.segment_size
+            if roll_over:
+                segments.pop(own, None)
+            if changed or roll_over:
+                self._write_snapshot(segments, counts)
+            if roll_over:
+                if os.path.exists(self.segment):
+                    os.remove(self.segment)
+                if not close:
+                    self.segment = self._new_segment()
+            return counts
+
+    def _new_segment(self) -> str:
+        segment_id = f"{os.getpid()}-{os.urandom(4).hex()}"
+        return f"{self.filename}.{segment_id}{SEGMENT_SUFFIX}"
+
+    def _read_snapshot(self) -> Tuple[Dict[str, int], Dict[str, int]]:
+        # The offsets merged per segment first, then a line per timezone
+        try:
+            with open(self.snapshot, "rb") as f, mmap.mmap(
+                f.fileno(), 0, access=mmap.ACCESS_READ
+            ) as snapshot:
+                merged = json.loads(snapshot.readline())
+                if not isinstance(merged, dict):
+                    raise ValueError("missing the merged offsets")
+                counts = {}
+                for line in iter(snapshot.readline, b""):
+                    try:
+                        count, tz = line.rstrip(b"\n").split(b"\t", 1)
+                        counts[tz.decode()] = int(count)
+                    except ValueError:
+                        logger.warning(
+                            f"Skipped a malformed popularity record in {self.snapshot}"
+                        )
+                return merged, counts
+        except FileNotFoundError:
+            return {}, {}
+        except ValueError as e:
+            # Empty files can't even be mapped
+            logger.warning(f"Ignored the popularity snapshot {self.snapshot}: {str(e)}")
+            return {}, {}
+
+    def _write_snapshot(self, merged: Dict[str, int], counts: Dict[str, int]) -> None:
+        def write(f: TextIO) -> None:
+            f.write(json.dumps(merged, separators=(",", ":")) + "\n")
+            f.writelines(f"{count}\t{tz}\n" for tz, count in counts.items())
+
+        # Only written while locked, so no other process writes it meanwhile
+        files.write_atomically(self.snapshot, write)
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        with open(f"{self.filename}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _merge_segment(path: str, offset: int, counts: Dict[str, int]) -> int:
+    """Adds the records of a segment past offset to counts.
+
+    Returns the offset merged up to. A last incomplete line is left for
+    the next compaction, as it may still be being written.
+    """
+    try:
+        with open(path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return offset
+
+    end = data.rfind(b"\n") + 1
+    for line in data[:end].splitlines():
+        try:
+            count, tz = line.split(b"\t", 1)
+            tz = tz.decode()
+            counts[tz] = counts.get(tz, 0) + int(count)
+        except ValueError:
+            logger.warning(f"Skipped a malformed popularity record in {path}")
+    return offset + end
+
+
+def _has_shelve(filename: str) -> bool:
+    import dbm
+
+    return bool(dbm.whichdb(filename))
+
+
+def _migrate_shelve(filename: str) -> Dict[str, int]:
+    """Returns the counts per timezone of a shelve kept per prefix."""
+    import shelve
+
+    with shelve.open(filename, "r") as poll:
+        per_prefix = dict(poll)
+
+    # What a prefix counts on its own, besides the timezones under it
+    counts = dict(per_prefix)
+    for prefix, count in per_prefix.items():
+        parent, _, _ = prefix.rpartition("/")
+        if parent in counts:
+            counts[parent] -= count
+
+    logger.info(f"Migrated the popularity poll from {filename}")
+    return {tz: count for tz, count in counts.items() if count > 0}
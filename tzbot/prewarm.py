@@ -0,0 +1,120 @@
+import asyncio
+import logging
+
+from typing import TYPE_CHECKING, List, Optional
+
+from . import api_client as api
+from . import files
+from . import settings
+from .offsets import OffsetCache
+
+if TYPE_CHECKING:
+    from aiohttp import ClientSession
+
+logger = logging.getLogger("tzbot")
+
+
+class OffsetPrewarmer:
+    r"""Keeps the UTC offsets of every timezone cached ahead of commands.
+
+    On open, the offsets saved by the last run are restored from a
+    snapshot file. Then, in the background, the offsets of every
+    timezone the time API knows of are fetched, and the ones about to
+    expire are refreshed every `refresh_interval` seconds. The snapshot
+    is saved after every round and on close.
+
+    Arguments:
+
+        offsets -- The OffsetCache to keep warm.
+
+        filename -- The snapshot file. Defaults to
+            `settings.OFFSET_SNAPSHOT_FILENAME`.
+
+        concurrency -- Maximum number of requests at a time. Defaults
+            to `settings.PREWARM_CONCURRENCY`.
+
+        refresh_interval -- Defaults to
+            `settings.PREWARM_REFRESH_INTERVAL`.
+    """
+
+    def __init__(
+        self,
+        offsets: OffsetCache,
+        filename: Optional[str] = None,
+        concurrency: Optional[int] = None,
+        refresh_interval: Optional[float] = None,
+    ) -> None:
+        self.offsets = offsets
+        self.filename = filename or settings.OFFSET_SNAPSHOT_FILENAME
+        self.concurrency = concurrency or settings.PREWARM_CONCURRENCY
+        self.refresh_interval = refresh_interval or settings.PREWARM_REFRESH_INTERVAL
+        self.refresher = None
+
+    async def open(self, session: "ClientSession") -> None:
+        """Restores the snapshot and starts refreshing in the background."""
+        loop = asyncio.get_running_loop()
+        snapshot = await loop.run_in_executor(None, self._read_snapshot)
+        try:
+            self.offsets.restore(snapshot)
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Couldn't restore the offsets snapshot: {str(e)}")
+        else:
+            logger.info(f"Restored the offsets of {len(snapshot)} timezones")
+
+        self.refresher = asyncio.create_task(self._refresh_periodically(session))
+
+    async def close(self) -> None:
+        """Stops refreshing and saves the snapshot."""
+        if self.refresher:
+            self.refresher.cancel()
+            try:
+                await self.refresher
+            except asyncio.CancelledError:
+                pass
+            self.refresher = None
+
+        await self.save()
+
+    async def refresh(self, session: "ClientSession", timezones: List[str]) -> int:
+        """Fetches the offsets of timezones. Returns how many succeeded."""
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def fetch(timezone: str) -> bool:
+            async with slots:
+                try:
+                    await api.fetch_offset(timezone, session, self.offsets)
+                except api.APIError as e:
+                    logger.debug("Couldn't prewarm %s: %s", timezone, e)
+                    return False
+                return True
+
+        return sum(await asyncio.gather(*[fetch(tz) for tz in timezones]))
+
+    async def save(self) -> None:
+        snapshot = self.offsets.snapshot()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._write_snapshot, snapshot)
+
+    async def _refresh_periodically(self, session: "ClientSession") -> None:
+        try:
+            timezones = await api.get_timezones(session)
+        except api.APIError as e:
+            logger.warning(f"Couldn't retrieve the timezones to prewarm: {str(e)}")
+            timezones = []
+
+        # Unknown timezones first, then the ones about to expire
+        missing = [tz for tz in timezones if tz not in self.offsets.offsets]
+        while True:
+            stale = missing + self.offsets.expiring(within=self.refresh_interval)
+            refreshed = await self.refresh(session, stale)
+            logger.info(f"Prewarmed the offsets of {refreshed}/{len(stale)} timezones")
+            missing = []
+
+            await self.save()
+            await asyncio.sleep(self.refresh_interval)
+
+    def _read_snapshot(self) -> dict:
+        return files.read_json(self.filename, "the offsets snapshot")
+
+    def _write_snapshot(self, snapshot: dict) -> None:
+        files.write_json(self.filename, snapshot, "the offsets snapshot")
@@ -0,0 +1,131 @@
+import asyncio
+import cProfile
+import json
+import logging
+import os
+import threading
+import time
+
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from typing import Any, ContextManager, Deque, Iterator, Optional, Tuple
+
+from . import settings
+
+logger = logging.getLogger("tzbot")
+
+Span = Tuple[str, float, float, int, dict]
+
+_DISABLED = nullcontext()
+
+
+class Tracer:
+    r"""Records spans of work, to be dumped in the Chrome trace format.
+
+    Nothing is recorded until the tracer is enabled, so spans cost next
+    to nothing otherwise. Only the last `max_spans` are kept.
+
+    Spans are grouped per asyncio task, so every command gets its own
+    track. Spans recorded outside the event loop (e.g. in the executor)
+    are grouped per thread.
+
+    Arguments:
+
+        max_spans -- Defaults to `settings.PROFILE_MAX_SPANS`.
+    """
+
+    def __init__(self, max_spans: Optional[int] = None) -> None:
+        self.enabled = False
+        self.spans: Deque[Span] = deque(maxlen=max_spans or settings.PROFILE_MAX_SPANS)
+
+    def span(self, name: str, **args: Any) -> ContextManager[None]:
+        """Records the time spent in the block, if enabled."""
+        if not self.enabled:
+            return _DISABLED
+        return self._record(name, args)
+
+    @contextmanager
+    def _record(self, name: str, args: dict) -> Iterator[None]:
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started_at
+            self.spans.append((name, started_at, elapsed, _track_id(), args))
+
+    def dump(self, filename: str) -> None:
+        """Writes the recorded spans as a Chrome trace JSON file."""
+        pid = os.getpid()
+        events = [
+            {
+                "name": name,
+                "ph": "X",
+                "ts": started_at * 1e6,
+                "dur": elapsed * 1e6,
+                "pid": pid,
+                "tid": track,
+                "args": args,
+            }
+            for name, started_at, elapsed, track, args in list(self.spans)
+        ]
+        with open(filename, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+class Profiler:
+    r"""Profiles the running bot, dumping the results on demand.
+
+    Asyncio debug mode is enabled, so callbacks blocking the event loop
+    longer than `settings.PROFILE_SLOW_CALLBACK` seconds are logged.
+
+    If filename ends in `.json`, spans of every command are traced and
+    dumped in the Chrome trace format (to be opened in `about:tracing`
+    or Perfetto). Otherwise, the process is profiled with cProfile and
+    dumped as pstats.
+
+    Arguments:
+
+        filename -- Where the results are dumped.
+    """
+
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+        self.profile = None if filename.endswith(".json") else cProfile.Profile()
+
+    def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        loop.set_debug(True)
+        loop.slow_callback_duration = settings.PROFILE_SLOW_CALLBACK
+
+        if self.profile:
+            self.profile.enable()
+        else:
+            tracer.enabled = True
+
+    def stop(self) -> None:
+        self.dump()
+        if self.profile:
+            self.profile.disable()
+        else:
+            tracer.enabled = False
+
+    def dump(self) -> None:
+        """Writes the results so far, while profiling goes on."""
+        if self.profile:
+            # Dumping stops the profiler
+            self.profile.dump_stats(self.filename)
+            self.profile.enable()
+        else:
+            tracer.dump(self.filename)
+        logger.info(f"Profile dumped to {self.filename}")
+
+
+def _track_id() -> int:
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    return id(task) if task else threading.get_ident()
+
+
+tracer = Tracer()
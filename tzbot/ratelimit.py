@@ -0,0 +1,35 @@
+import time
+
+
+class TokenBucket:
+    r"""A token bucket, refilled at a constant rate up to its capacity.
+
+    Arguments:
+
+        rate -- Tokens added per second.
+
+        burst -- Maximum number of tokens the bucket holds. It starts
+            full.
+    """
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate, self.burst = rate, burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self, amount: int = 1) -> int:
+        """Takes up to amount whole tokens. Returns how many were taken."""
+        self._refill()
+        taken = min(amount, int(self.tokens))
+        self.tokens -= taken
+        return taken
+
+    def delay(self, amount: int = 1) -> float:
+        """Returns the seconds until amount tokens are available."""
+        self._refill()
+        return max(0.0, (amount - self.tokens) / self.rate)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
@@ -0,0 +1,89 @@
+import logging
+import re
+import time
+
+from collections import Counter
+from typing import BinaryIO, Dict, Iterable, Optional
+
+from . import irc
+from . import settings
+from .aliases import AliasIndex
+from .pollstore import PollStore
+from .stream import parse_stdio_message
+
+logger = logging.getLogger("tzbot")
+
+# Searched for in C, discarding most lines before any Python code runs
+_TIMEAT_SEARCH = re.compile(rb"!timeat").search
+
+
+def rebuild_popularity(
+    logs: Iterable[str], filename: Optional[str] = None
+) -> Dict[str, int]:
+    """Adds the `!timeat` requests found in logs to the popularity poll.
+
+    Log lines are either raw IRC messages, as received from the server,
+    or `<nick>: <message>` lines, as read from STDIO. Logs ending in
+    `.gz` are decompressed on the fly.
+
+    Lines are first counted per distinct command, so every command is
+    parsed and its aliases resolved once however many times it was
+    sent. Only the names resolving to known timezones are counted, as
+    the bot only counts the timezones it could tell the time at. The
+    counts are added to the poll in a single write.
+
+    Returns the counts added per timezone.
+    """
+    started_at = time.monotonic()
+    texts = Counter()
+    for log in logs:
+        with _open(log) as f:
+            texts.update(filter(None, map(_command_text, filter(_TIMEAT_SEARCH, f))))
+
+    aliases, counts = AliasIndex(), Counter()
+    for text, sent in texts.items():
+        command = irc.parse_bot_command(text)
+        if command is None or command[0] != "!timeat":
+            continue
+
+        names = aliases.split(command[1], settings.TIMEAT_MAX_ZONES)
+        for timezone in {aliases.resolve(name) for name in names} - {None}:
+            counts[timezone] += sent
+
+    if counts:
+        store = PollStore(filename or settings.POLL_FILENAME)
+        store.append(counts)
+        store.compact(close=True)
+
+    logger.info(
+        f"Added {sum(counts.values())} requests for {len(counts)} timezones "
+        f"from {sum(texts.values())} commands in {time.monotonic() - started_at:.1f} s"
+    )
+    return dict(counts)
+
+
+def _open(log: str) -> BinaryIO:
+    if log.endswith(".gz"):
+        import gzip
+
+        return gzip.open(log, "rb")
+    return open(log, "rb")
+
+
+def _command_text(line: bytes) -> Optional[str]:
+    """Returns the message a log line carries, or None if it has none."""
+    line = line.rstrip(b"\r\n")
+
+    if line[:1] in (b":", b"@"):
+        message = irc.parse_message(line)
+        if (
+            message is None
+            or message.command != "PRIVMSG"
+            or message.nick is None
+            or len(message.params) != 2
+        ):
+            return None
+        return message.trailing
+
+    message = parse_stdio_message(line.decode(errors="replace"))
+    return message[1] if message else None
@@ -0,0 +1,143 @@
+import asyncio
+import logging
+
+from collections import OrderedDict, deque
+from itertools import count
+from typing import Awaitable, Callable, Deque, List, Optional, Tuple
+
+from . import settings
+
+logger = logging.getLogger("tzbot")
+
+Job = Callable[[], Awaitable[None]]
+# (priority, submission order, job)
+Entry = Tuple[int, int, Job]
+
+
+class Scheduler:
+    r"""Runs jobs with bounded concurrency, taking turns between submitters.
+
+    Jobs are queued per key (e.g. the nick that sent the command) and
+    run by a fixed pool of workers, which take the next job from each
+    key in a round-robin fashion so a busy key can't starve the rest.
+
+    Once `max_queued` jobs are waiting, `submit()` blocks until a
+    worker takes one, slowing down whoever is feeding the scheduler.
+    If shedding load instead, the oldest of the lowest priority jobs
+    queued is dropped to make room, or the new one if its priority is
+    lower still.
+
+    Arguments:
+
+        max_concurrency -- Maximum number of jobs running at a time.
+            Defaults to `settings.MAX_CONCURRENT_COMMANDS`.
+
+        max_queued -- Maximum number of jobs waiting to run.
+            Defaults to `settings.MAX_QUEUED_COMMANDS`.
+
+        shed -- Whether to drop jobs rather than block once full.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: Optional[int] = None,
+        max_queued: Optional[int] = None,
+        shed: bool = False,
+    ) -> None:
+        self.max_concurrency = max_concurrency or settings.MAX_CONCURRENT_COMMANDS
+        self.max_queued = max_queued or settings.MAX_QUEUED_COMMANDS
+        self.shed = shed
+        self.queues: "OrderedDict[str, Deque[Entry]]" = OrderedDict()
+        self.order = count()
+        self.queued = 0
+        self.dropped = 0
+        self.in_flight = 0
+        self.workers: List[asyncio.Task] = []
+        self.ready = self.room = None
+
+    def start(self) -> None:
+        """Spawns the workers."""
+        # One item per queued job, so a worker never wakes up empty-handed
+        self.ready = asyncio.Queue()
+        self.room = asyncio.Semaphore(self.max_queued)
+        self.workers = [
+            asyncio.create_task(self._work()) for _ in range(self.max_concurrency)
+        ]
+
+    async def submit(self, key: str, job: Job, priority: int = 0) -> bool:
+        """Queues job under key, waiting for room in the queue if full.
+
+        Returns whether the job was queued, as it's dropped right away
+        when shedding load and nothing queued has a lower priority.
+        """
+        entry = (priority, next(self.order), job)
+
+        if self.shed and self.room.locked():
+            # Take the place of a dropped job, already counted as queued
+            if not self._drop_lowest(priority):
+                self.dropped += 1
+                logger.warning("Queue full, dropped a job from '%s'", key)
+                return False
+            self.queues.setdefault(key, deque()).append(entry)
+            return True
+
+        await self.room.acquire()
+        self.queues.setdefault(key, deque()).append(entry)
+        self.queued += 1
+        self.ready.put_nowait(None)
+        return True
+
+    async def join(self) -> None:
+        """Waits until every submitted job is done."""
+        await self.ready.join()
+
+    async def close(self) -> None:
+        """Stops the workers, dropping the jobs still queued."""
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    async def _work(self) -> None:
+        while True:
+            await self.ready.get()
+            job = self._next_job()
+            self.in_flight += 1
+            try:
+                await job()
+            except Exception:
+                logger.exception("Unexpected error while running a job")
+            finally:
+                self.in_flight -= 1
+                self.ready.task_done()
+
+    def _drop_lowest(self, priority: int) -> bool:
+        """Drops the oldest lowest priority job, unless above priority."""
+        # Jobs of a key are queued in order, but not by priority
+        key, lowest = min(
+            ((key, entry) for key, queue in self.queues.items() for entry in queue),
+            key=lambda item: item[1][:2],
+        )
+        if lowest[0] > priority:
+            return False
+
+        self.queues[key].remove(lowest)
+        if not self.queues[key]:
+            del self.queues[key]
+        self.dropped += 1
+        logger.warning("Queue full, dropped a job from '%s'", key)
+        return True
+
+    def _next_job(self) -> Job:
+        key, queue = next(iter(self.queues.items()))
+        _, _, job = queue.popleft()
+
+        if queue:
+            # Let other keys go first next time
+            self.queues.move_to_end(key)
+        else:
+            del self.queues[key]
+
+        self.queued -= 1
+        self.room.release()
+        return job
@@ -4,11 +4,78 @@ from os import getenv
 BACKOFF_INITIAL_WAIT = 1
 BACKOFF_MAX_RETRIES = 4
 
+# Seconds a command can wait for the time API, and a single request
+COMMAND_DEADLINE = 5
+API_TIMEOUT = 3
+API_HEDGE_DELAY = 0.5
+CIRCUIT_MAX_FAILURES = 5
+CIRCUIT_RESET_AFTER = 30
+HTTP_CACHE_FILENAME = None
+HTTP_CACHE_SIZE = 64
+
+OFFSET_CACHE_TTL = 3600
+OFFSET_SNAPSHOT_FILENAME = "offsets_snapshot.json"
+PREWARM = False
+PREWARM_CONCURRENCY = 8
+PREWARM_REFRESH_INTERVAL = 300
+RESPONSE_CACHE_SIZE = 1024
+
+ALIAS_MIN_PREFIX = 3
+ALIAS_MAX_WORDS = 4
+
+TIMEAT_MAX_ZONES = 8
+
+MAX_CONCURRENT_COMMANDS = 32
+MAX_QUEUED_COMMANDS = 256
+# Drop queued commands rather than stop reading new ones once full
+SHED_LOAD = False
+# Commands dropped last when shedding load. Any other is dropped first
+COMMAND_PRIORITIES = {"!timepopularity": 2, "!timeat": 1}
+
+# Limit the commands per nick, dropping those over the rate or repeated
+LIMIT_NICKS = False
+# Commands per second allowed per nick, and how many at once
+NICK_COMMAND_RATE = 0.5
+NICK_COMMAND_BURST = 10
+# Seconds during which the same command from the same nick is dropped
+DUPLICATE_WINDOW = 5
+ADMISSION_MAX_NICKS = 4096
+
+BATCH_CONCURRENCY = 256
+BATCH_MAX_PENDING = 4096
+BATCH_DEDUP_WINDOW = 1.0
+
+STDIO_READ_CHUNK_SIZE = 1 << 16
+
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = None
+
+LOG_LEVEL = getenv("LOG_LEVEL", default="INFO")
+LOG_JSON = False
+# Fraction of the per-command logs kept per category (i.e. commands, irc)
+LOG_SAMPLE_RATES = {}
+
+PROFILE_SLOW_CALLBACK = 0.05
+PROFILE_MAX_SPANS = 100_000
+
 TAG_USER = False
 POLL_FILENAME = "popularity_poll"
+POLL_FLUSH_INTERVAL = 10
+# Bytes a process appends to its poll segment before starting a new one
+POLL_SEGMENT_SIZE = 1 << 20
+# Seconds covered by the windows popularity can be asked within, and
+# the number of buckets they are counted in
+POPULARITY_WINDOWS = {"hour": (3600, 60), "day": (86400, 24)}
+POPULARITY_TOP_DEFAULT = 5
+POPULARITY_TOP_MAX = 10
 TIME_API = getenv("TIME_API", default="https://worldtimeapi.org/")
+TIME_API_MIRROR = getenv("TIME_API_MIRROR")
 
 IRC_SERVER = "chat.freenode.net"
 IRC_PORT = 6667
 IRC_NICK = "el_tzbot"
 IRC_CHANNEL = "##mrocha"
+# (server, port, channels) to join to. Built from the above unless given
+IRC_NETWORKS = []
+IRC_SEND_RATE = 2
+IRC_SEND_BURST = 5
@@ -1,14 +1,26 @@
 import asyncio
 import logging
+import os
 import re
+import stat
 import sys
+import time
 
 from abc import ABC, abstractmethod
-from typing import List, Optional, Tuple
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
 
+from . import irc
+from . import metrics
 from . import settings
+from .ratelimit import TokenBucket
 
 logger = logging.getLogger("tzbot")
+# Logs every command and PING, so it's sampled apart from the rest
+irc_logger = logging.getLogger("tzbot.irc")
+
+_STDIO_MESSAGE_REGEX = re.compile(r"([a-zA-Z]\w{0,31}): (.*)")
+_IRC_COMMAND_MARKER = irc.BOT_COMMAND_MARKER.encode()
 
 
 class ChatStream(ABC):
@@ -20,108 +32,404 @@ class ChatStream(ABC):
     async def send_message(self, nick: str, msg: str) -> None:
         """Sends message to the stream"""
 
+    async def close(self) -> None:
+        """Flushes pending messages and releases the stream"""
+
 
 class StdioStream(ChatStream):
+    r"""A stream reading commands from and writing messages to files.
+
+    Once connected, pipes and sockets are read and written natively
+    through asyncio, and regular files are read in chunks of lines in
+    the default executor. In both cases, the messages sent during a
+    loop iteration are written at once. Any other kind of file (e.g. a
+    terminal, or an unconnected stream) is read and written a line at a
+    time in the default executor.
+    """
+
     def __init__(self, istream=sys.stdin, ostream=sys.stdout):
         self.istream, self.ostream = istream, ostream
+        self.reader = self.writer = None
+        self.read_in_chunks = self.write_directly = False
+        self.lines: Deque[str] = deque()
+        self.outbox: List[str] = []
+
+    async def connect(self) -> None:
+        loop = asyncio.get_running_loop()
+
+        if _is_pipe(self.istream):
+            self.reader = asyncio.StreamReader()
+            protocol = asyncio.StreamReaderProtocol(self.reader)
+            await loop.connect_read_pipe(lambda: protocol, self.istream)
+        elif _is_regular_file(self.istream):
+            self.read_in_chunks = True
+
+        # Pipes are made non-blocking, which would break blocking writes
+        # to stderr (i.e. the logs) if it's the very same pipe
+        if _is_pipe(self.ostream) and not _is_same_file(self.ostream, sys.stderr):
+            transport, protocol = await loop.connect_write_pipe(
+                asyncio.streams.FlowControlMixin, self.ostream
+            )
+            self.writer = asyncio.StreamWriter(transport, protocol, None, loop)
+        elif _is_regular_file(self.ostream):
+            # Writing to a regular file doesn't block for long
+            self.write_directly = True
+
+    async def close(self) -> None:
+        self._flush()
+        if self.writer:
+            await self.writer.drain()
 
     async def read_command(self) -> Tuple[str, str, List[str]]:
         line = await self._readline()
 
-        while line and not self._is_command(line):
+        while line:
+            started_at = time.perf_counter()
+            command = self._parse_command(line)
+            if command:
+                elapsed = time.perf_counter() - started_at
+                metrics.COMMAND_LATENCY.observe(elapsed, stage="parse")
+                return command
             line = await self._readline()
 
-        if not line:
-            raise EOFError()
-
-        return self._parse_command(line)
+        raise EOFError()
 
     async def send_message(self, nick: str, msg: str) -> None:
         prefix = f"{nick}: " if settings.TAG_USER else ""
         await self._write(f"{prefix}{msg}\n")
 
-    async def _readline(self) -> None:
+    async def _readline(self) -> str:
+        if self.reader:
+            try:
+                return (await self.reader.readline()).decode(errors="replace")
+            except ValueError:
+                # The line is over the reader's limit and was discarded
+                return "\n"
+
+        if self.lines:
+            return self.lines.popleft()
+
         loop = asyncio.get_running_loop()
-        return await loop.run_in_executor(None, self.istream.readline)
+        if not self.read_in_chunks:
+            return await loop.run_in_executor(None, self.istream.readline)
+
+        lines = await loop.run_in_executor(
+            None, self.istream.readlines, settings.STDIO_READ_CHUNK_SIZE
+        )
+        self.lines.extend(lines)
+        return self.lines.popleft() if self.lines else ""
 
     async def _write(self, msg: str) -> None:
+        if self.writer or self.write_directly:
+            if not self.outbox:
+                asyncio.get_running_loop().call_soon(self._flush)
+            self.outbox.append(msg)
+            if self.writer:
+                # Only waits if the pipe's buffer is over the high-water mark
+                await self.writer.drain()
+            return
+
         loop = asyncio.get_running_loop()
         return await loop.run_in_executor(None, self.ostream.write, msg)
 
+    def _flush(self) -> None:
+        if not self.outbox:
+            return
+
+        if self.writer:
+            if not self.writer.is_closing():
+                self.writer.write("".join(self.outbox).encode())
+        else:
+            self.ostream.write("".join(self.outbox))
+            self.ostream.flush()
+        self.outbox.clear()
+
     def _is_command(self, line: str) -> bool:
-        cmd_regex = r"[a-zA-Z]\w{0,31}: \s*(!timeat|!timepopularity) .+"
-        return re.fullmatch(cmd_regex, line.strip()) is not None
+        return self._parse_command(line) is not None
 
-    def _parse_command(self, line: str) -> Tuple[str, str, List[str]]:
-        if not self._is_command(line):
-            raise ValueError("invalid command message")
+    def _parse_command(self, line: str) -> Optional[Tuple[str, str, List[str]]]:
+        """Parses a `<nick>: <command>` line. Returns None if it isn't one."""
+        message = parse_stdio_message(line)
+        command = irc.parse_bot_command(message[1]) if message else None
+        return (message[0], *command) if command else None
 
-        nick, msg = line.split(": ", 1)
-        cmd = msg.strip().split()
-        cmd, args = cmd[0], cmd[1:]
 
-        return nick, cmd, args
+class IRCConnection:
+    r"""A connection to an IRC server, shared by the channels joined through it.
 
+    A single reader routes the commands received to the stream of the
+    channel they were sent to, and answers pings. Commands for a channel
+    whose queue is full are dropped, so a busy channel never holds up
+    the others or the pings.
 
-class IRCStream(ChatStream):
-    def __init__(self, server: str, port: int, nick: str, channel: str) -> None:
-        self.server, self.port = server, port
-        self.nick, self.channel = nick, channel
+    Outgoing messages are queued and written by a single sender, at
+    most `IRC_SEND_RATE` per second (bursts of up to `IRC_SEND_BURST`)
+    to keep the server's flood control at bay. Whatever is queued by
+    the time the sender gets to write is written at once. Control lines
+    (i.e. PONG and JOIN) skip the queue and the rate limit so pings
+    never wait behind messages.
+
+    `sent`, `queue_latency_total` and `queue_latency_max` keep track of
+    the number of messages sent and the seconds they waited queued.
+
+    Arguments:
+
+        server, port -- Address of the IRC server.
+
+        nick -- Nick the bot connects with.
+    """
+
+    def __init__(self, server: str, port: int, nick: str) -> None:
+        self.server, self.port, self.nick = server, port, nick
         self.istream = self.ostream = None
+        self.reader = self.sender = None
+        self.streams: Dict[str, "IRCStream"] = {}
+        self.bucket = TokenBucket(settings.IRC_SEND_RATE, settings.IRC_SEND_BURST)
+        self.outbox: Deque[Tuple[bytes, float, asyncio.Future]] = deque()
+        self.control: List[bytes] = []
+        self.wakeup = asyncio.Event()
+        self.sent = 0
+        self.queue_latency_total = self.queue_latency_max = 0.0
 
     async def connect(self) -> None:
         self.istream, self.ostream = await asyncio.open_connection(
             self.server, self.port
         )
 
-        logger.debug(f"IRC: Joining channel {self.channel} as {self.nick}")
+        logger.debug(f"IRC: Connecting to {self.server} as {self.nick}")
         self.ostream.writelines(
             [
                 f"NICK {self.nick}\r\n".encode(),
                 f"USER {self.nick} 0 * :{self.nick}\r\n".encode(),
-                f"JOIN {self.channel}\r\n".encode(),
             ]
         )
         await self.ostream.drain()
 
+        self.reader = asyncio.create_task(self._read_lines())
+        self.sender = asyncio.create_task(self._send_queued())
+
+    def join(self, channel: str) -> "IRCStream":
+        """Joins channel, returning the stream to chat on it."""
+        logger.debug(f"IRC: Joining channel {channel} on {self.server}")
+        stream = self.streams[channel.lower()] = IRCStream(self, channel)
+        self.control.append(f"JOIN {channel}\r\n".encode())
+        self.wakeup.set()
+        return stream
+
+    async def close(self) -> None:
+        for task in [self.reader, self.sender]:
+            if task:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        self.reader = self.sender = None
+
+        if self.ostream and not self.ostream.is_closing():
+            self.ostream.close()
+
+        if self.sent:
+            logger.info(
+                f"IRC: sent {self.sent} messages to {self.server}, queue latency "
+                f"avg {self.queue_latency_total / self.sent * 1000:.1f} ms, "
+                f"max {self.queue_latency_max * 1000:.1f} ms"
+            )
+
+    async def send(self, message: bytes) -> None:
+        """Queues the message, waiting until it's written."""
+        if self.sender is None or self.sender.done():
+            raise ConnectionResetError("connection closed")
+
+        sent = asyncio.get_running_loop().create_future()
+        self.outbox.append((message, time.monotonic(), sent))
+        self.wakeup.set()
+        await sent
+
+    async def _read_lines(self) -> None:
+        try:
+            while not self.istream.at_eof():
+                try:
+                    line = await self.istream.readuntil(separator=b"\r\n")
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+
+                started_at = time.perf_counter()
+                message = self._parse_message(line[:-2])
+                if message is None:
+                    continue
+                if message.command == "PING":
+                    self._pong(message)
+                    continue
+
+                command = self._command_of(message)
+                if command:
+                    elapsed = time.perf_counter() - started_at
+                    metrics.COMMAND_LATENCY.observe(elapsed, stage="parse")
+                    self._route(*command)
+        finally:
+            self.ostream.close()
+            for stream in self.streams.values():
+                stream.eof = True
+                # Wake up a reader waiting for commands. If the queue is
+                # full, it'll notice EOF once it runs out of commands
+                if not stream.commands.full():
+                    stream.commands.put_nowait(None)
+
+    def _parse_command(
+        self, line: bytes
+    ) -> Optional[Tuple[str, Tuple[str, str, List[str]]]]:
+        """Parses a bot command sent over PRIVMSG along with its channel.
+
+        Returns None for anything else.
+        """
+        message = self._parse_message(line)
+        return self._command_of(message) if message else None
+
+    def _parse_message(self, line: bytes) -> Optional[irc.Message]:
+        """Parses a line if it may be a bot command or a ping."""
+        # Most lines are neither. Discard them without a full parse
+        if _IRC_COMMAND_MARKER not in line and b"PING" not in line:
+            return None
+        return irc.parse_message(line)
+
+    def _command_of(
+        self, message: irc.Message
+    ) -> Optional[Tuple[str, Tuple[str, str, List[str]]]]:
+        if (
+            message.command != "PRIVMSG"
+            or message.nick is None
+            or len(message.params) != 2
+        ):
+            return None
+
+        command = irc.parse_bot_command(message.trailing)
+        if command is None:
+            return None
+
+        irc_logger.debug(
+            "IRC: parsed command from %s: %s", message.nick, message.trailing
+        )
+        return message.params[0], (message.nick, *command)
+
+    def _route(self, channel: str, command: Tuple[str, str, List[str]]) -> None:
+        stream = self.streams.get(channel.lower())
+        if stream is None:
+            return
+        try:
+            stream.commands.put_nowait(command)
+        except asyncio.QueueFull:
+            metrics.COMMANDS_REJECTED.inc(reason="queue_full")
+            irc_logger.warning(
+                "IRC: dropped a command to %s, its queue is full", channel
+            )
+
+    def _pong(self, message: irc.Message) -> None:
+        if not message.params:
+            return
+
+        irc_logger.debug("IRC: PONG %s", message.trailing)
+        self.control.append(f"PONG :{message.trailing}\r\n".encode())
+        self.wakeup.set()
+
+    async def _send_queued(self) -> None:
+        messages = []
+        try:
+            while True:
+                self.wakeup.clear()
+                lines, self.control = self.control, []
+                amount = self.bucket.take(len(self.outbox))
+                messages = [self.outbox.popleft() for _ in range(amount)]
+
+                if not lines and not messages:
+                    # Wait for new lines, or for a token if messages are queued
+                    delay = self.bucket.delay() if self.outbox else None
+                    try:
+                        await asyncio.wait_for(self.wakeup.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                if self.ostream.is_closing():
+                    raise ConnectionResetError("connection closed")
+
+                lines.extend(message for message, _, _ in messages)
+                self.ostream.write(b"".join(lines))
+                await self.ostream.drain()
+
+                now = time.monotonic()
+                for _, queued_at, sent in messages:
+                    latency = now - queued_at
+                    metrics.IRC_QUEUE_LATENCY.observe(latency)
+                    self.sent += 1
+                    self.queue_latency_total += latency
+                    self.queue_latency_max = max(self.queue_latency_max, latency)
+                    if not sent.done():
+                        sent.set_result(None)
+        except Exception as e:
+            self._fail_queued(messages, e)
+            raise
+        finally:
+            self._fail_queued(self.outbox, ConnectionResetError("connection closed"))
+            self.outbox.clear()
+
+    def _fail_queued(self, messages, error: Exception) -> None:
+        for _, _, sent in messages:
+            if not sent.done():
+                sent.set_exception(error)
+
+
+class IRCStream(ChatStream):
+    r"""A stream reading commands from and writing messages to an IRC channel.
+
+    Streams are obtained by joining a channel through an IRCConnection,
+    and as many of them as needed can share the same connection.
+    """
+
+    def __init__(self, connection: IRCConnection, channel: str) -> None:
+        self.connection, self.channel = connection, channel
+        self.commands = asyncio.Queue(settings.MAX_QUEUED_COMMANDS)
+        self.eof = False
+
     async def read_command(self) -> Tuple[str, str, List[str]]:
-        while not self.istream.at_eof():
-            try:
-                line = await self.istream.readuntil(separator=b"\r\n")
-            except asyncio.IncompleteReadError:
-                self.ostream.close()
-                raise EOFError()
-            else:
-                line = line[:-2].decode()
-                if self._is_command(line):
-                    return self._parse_command(line)
-                if self._is_ping(line):
-                    await self._pong(line)
-
-        self.ostream.close()
-        raise EOFError()
+        if self.eof and self.commands.empty():
+            raise EOFError()
+
+        command = await self.commands.get()
+        if command is None:
+            raise EOFError()
+        return command
 
     async def send_message(self, nick: str, msg: str) -> None:
         prefix = f"{nick}: " if settings.TAG_USER else ""
         message = f"PRIVMSG {self.channel} :{prefix}{msg}\r\n"
-        self.ostream.write(message.encode())
-        await self.ostream.drain()
+        await self.connection.send(message.encode())
 
-    def _is_command(self, line: str) -> bool:
-        cmd_regex = r":\S+ PRIVMSG \S+ :\s*(!timeat|!timepopularity) .+"
-        return re.fullmatch(cmd_regex, line) is not None
-
-    def _parse_command(self, line: str) -> Tuple[str, str, List[str]]:
-        logger.debug(f"IRC: parsing command '{line}'")
-        cmd_regex = r":([^!]+)!\S+ PRIVMSG \S+ :\s*(!timeat|!timepopularity) (.+)"
-        m = re.fullmatch(cmd_regex, line)
-        return m[1], m[2], m[3].split()
-
-    def _is_ping(self, line: str) -> bool:
-        return re.fullmatch(r"PING .+", line) is not None
-
-    async def _pong(self, line: str) -> None:
-        m = re.fullmatch(r"PING (.+)", line)
-        logger.debug(f"IRC: PONG {m[1]}")
-        self.ostream.write(f"PONG {m[1]}\r\n".encode())
-        await self.ostream.drain()
+
+def parse_stdio_message(line: str) -> Optional[Tuple[str, str]]:
+    """Splits a `<nick>: <message>` line into its nick and message.
+
+    Returns None if it isn't one.
+    """
+    m = _STDIO_MESSAGE_REGEX.fullmatch(line.strip())
+    return (m[1], m[2]) if m else None
+
+
+def _is_pipe(stream) -> bool:
+    """Whether the stream is a pipe or socket asyncio can handle natively."""
+    try:
+        mode = os.fstat(stream.fileno()).st_mode
+    except (AttributeError, OSError, ValueError):
+        return False
+    return stat.S_ISFIFO(mode) or stat.S_ISSOCK(mode)
+
+
+def _is_regular_file(stream) -> bool:
+    try:
+        return stat.S_ISREG(os.fstat(stream.fileno()).st_mode)
+    except (AttributeError, OSError, ValueError):
+        return False
+
+
+def _is_same_file(stream, other) -> bool:
+    try:
+        return os.path.sameopenfile(stream.fileno(), other.fileno())
+    except (AttributeError, OSError, ValueError):
+        return False
@@ -1,20 +1,31 @@
 #!/usr/bin/env python3
 import asyncio
-import importlib.resources as pkg_resources
 import logging
-import json
-import sys
 
-from aiohttp import ClientSession
+from contextlib import asynccontextmanager
 from datetime import datetime
-from pathlib import Path
-from typing import Dict, List
+from functools import partial
+from typing import TYPE_CHECKING, AsyncIterator, List, Optional, Tuple
 
 from . import api_client as api
-from . import poll
+from . import metrics
+from . import profiling
+from . import settings
+from .admission import AdmissionControl
+from .aliases import AliasIndex
+from .cache import ResponseCache
+from .poll import PopularityPoll
+from .prewarm import OffsetPrewarmer
+from .scheduler import Scheduler
+from .offsets import OffsetCache
 from .stream import ChatStream
 
+if TYPE_CHECKING:
+    from aiohttp import ClientSession
+
 logger = logging.getLogger("tzbot")
+# Logs every command, so it's sampled apart from the rest
+command_logger = logging.getLogger("tzbot.commands")
 
 
 class TZBot:
@@ -26,95 +37,245 @@ class TZBot:
     through a REST API call and keep track of the number of valid
     `!timeat` requests received per timezone prefix.
 
-    The bot's main loop preoccupies with dispatching new tasks for
-    processing incoming commands. These tasks, once concluded, will
-    write the message into the stream.
+    The bot's main loop preoccupies with queueing incoming commands
+    into a scheduler, which processes a bounded number of them at a
+    time taking turns between nicks. Once concluded, each command
+    writes its message into the stream.
+
+    If limiting nicks, commands over the rate allowed per nick, or
+    repeating the last one from the same nick, are dropped before being
+    queued. When shedding load, a full scheduler drops the oldest of the
+    least valuable commands (see `settings.COMMAND_PRIORITIES`) rather
+    than wait.
+
+    Commands can be read from several streams at once (e.g. many IRC
+    channels), sharing the same HTTP session, caches and poll. The
+    answer to a command is written to the stream it was read from.
 
-    Once EOF is reached, it waits for pending running tasks and exits.
+    Once EOF is reached on every stream, it waits for pending running
+    tasks and exits.
+
+    Aliases and the HTTP session are set up on first use, so starting
+    the bot stays cheap.
 
     Arguments:
 
-        stream -- A ChatStream object from where new commands can be
+        streams -- ChatStream objects from where new commands can be
             read and messages written.
     """
 
-    def __init__(self, stream: ChatStream) -> None:
-        self.stream = stream
+    def __init__(self, *streams: ChatStream) -> None:
+        self.streams = streams
         self.eof = False
-        self.aliases = self._load_aliases()
+        self.aliases = AliasIndex()
+        self._session: Optional["ClientSession"] = None
+        self.offsets = OffsetCache()
+        self.responses = ResponseCache()
+        self.prewarmer = OffsetPrewarmer(self.offsets) if settings.PREWARM else None
+        self.poll = PopularityPoll()
+        self.admission = AdmissionControl() if settings.LIMIT_NICKS else None
+        self.scheduler = Scheduler(shed=settings.SHED_LOAD)
+        metrics.COMMANDS_SHED.set_function(lambda: self.scheduler.dropped)
+        metrics.TASKS_IN_FLIGHT.set_function(lambda: self.scheduler.in_flight)
+        metrics.TASKS_QUEUED.set_function(lambda: self.scheduler.queued)
+        metrics.RESPONSE_CACHE_HITS.set_function(lambda: self.responses.hits)
+        metrics.RESPONSE_CACHE_MISSES.set_function(lambda: self.responses.misses)
 
     async def run(self) -> None:
         """Process every message in stream until EOF."""
-        async with ClientSession() as session:
-            self.session = session
-            tasks = []
+        async with self.started():
+            await self._dispatch_commands()
 
+    @asynccontextmanager
+    async def started(self) -> AsyncIterator["TZBot"]:
+        """Sets up what commands need to be answered for the duration of it."""
+        await self.poll.open()
+        await api.http_cache.open()
+        if self.prewarmer:
+            await self.prewarmer.open(self.session)
+        try:
+            yield self
+        finally:
+            if self.prewarmer:
+                await self.prewarmer.close()
+            await api.http_cache.close()
+            await self.poll.close()
+            if self._session is not None:
+                await self._session.close()
+                self._session = None
+            logger.info(f"Coalesced time lookups: {api.time_at_calls.coalesced}")
+
+    @property
+    def session(self) -> "ClientSession":
+        """The HTTP session, created on first use."""
+        if self._session is None:
+            from aiohttp import ClientSession
+
+            self._session = ClientSession()
+        return self._session
+
+    async def _dispatch_commands(self) -> None:
+        self.scheduler.start()
+        try:
             logger.info(f"Bot ready to receive commands")
-            while not self.eof:
-                try:
-                    nick, cmd, args = await self.stream.read_command()
-                except EOFError:
-                    self.eof = True
-                else:
-                    logger.info(f"Command received from '{nick}': {cmd} {args}")
-                    # Spawn a new concurrent task to process the command
-                    tasks.append(
-                        asyncio.create_task(self._process_cmd(nick, cmd, args))
-                    )
-                    # Filter out done tasks
-                    tasks = [t for t in tasks if not t.done()]
+            await asyncio.gather(*[self._read_commands(s) for s in self.streams])
+            self.eof = True
 
             logger.info(f"EOF reached. Waiting for remaining tasks and shutting down.")
-            await asyncio.gather(*tasks)
+            await self.scheduler.join()
+        finally:
+            await self.scheduler.close()
+
+    async def _read_commands(self, stream: ChatStream) -> None:
+        while True:
+            try:
+                nick, cmd, args = await stream.read_command()
+            except EOFError:
+                return
+
+            command_logger.info("Command received from '%s': %s %s", nick, cmd, args)
+            metrics.COMMANDS_RECEIVED.inc(command=cmd)
+
+            reason = self.admission and self.admission.admit(nick, cmd, args)
+            if reason:
+                command_logger.info(
+                    "Rejecting command from '%s' (%s): %s", nick, reason, cmd
+                )
+                metrics.COMMANDS_REJECTED.inc(reason=reason)
+                continue
 
-    async def _process_cmd(self, nick: str, cmd: str, args: List[str]) -> None:
+            # Queue the command, waiting while full unless shedding load
+            await self.scheduler.submit(
+                nick,
+                partial(self._process_cmd, stream, nick, cmd, args),
+                settings.COMMAND_PRIORITIES.get(cmd, 0),
+            )
+
+    async def _process_cmd(
+        self, stream: ChatStream, nick: str, cmd: str, args: List[str]
+    ) -> None:
         """Fulfills a given command.
 
         Once the result for the command is obtained, it writes it
-        into the stream. Non supported commands are ignored and no
-        messages are sent.
+        into the stream it came from. Non supported commands are
+        ignored and no messages are sent.
         """
-        message = None
+        with metrics.COMMAND_LATENCY.time(stage="total"), profiling.tracer.span(
+            "command", nick=nick, cmd=cmd, args=args
+        ):
+            message = await self._answer(cmd, args)
+
+            if message:
+                command_logger.info("Sending result for '%s': %s", nick, message)
+                with metrics.COMMAND_LATENCY.time(stage="send"):
+                    await stream.send_message(nick, message)
+            else:
+                command_logger.info(
+                    "Ignoring command from '%s': %s %s", nick, cmd, args
+                )
+                metrics.COMMANDS_IGNORED.inc()
 
-        if cmd == "!timeat" and len(args) == 1:
-            message = await self._timeat_cmd(args[0])
-        elif cmd == "!timepopularity" and len(args) == 1:
-            message = await self._timepopularity_cmd(args[0])
+    async def answer(
+        self, cmd: str, args: List[str]
+    ) -> Tuple[Optional[str], List[str]]:
+        """Works out the answer to a command, without counting it in the poll.
 
-        if message:
-            logger.info(f"Sending result for '{nick}': {message}")
-            await self.stream.send_message(nick, message)
-        else:
-            logger.info(f"Ignoring command from '{nick}': {cmd} {args}")
+        Returns the answer, or None if the command isn't supported, and
+        the timezones whose popularity the command adds to.
+        """
+        if cmd == "!timeat" and args:
+            return await self._timeat_answer(*self._split_timezones(args))
+        elif cmd == "!timepopularity" and 1 <= len(args) <= 3:
+            return await self._timepopularity_cmd(*args), []
+        return None, []
 
-    async def _timeat_cmd(self, tz: str) -> str:
-        """Implements the `!timeat <tzinfo>` command."""
-        # If timezone is an alias, use the full timezone name
-        if tz in self.aliases:
-            tz = self.aliases[tz]
+    async def _answer(self, cmd: str, args: List[str]) -> Optional[str]:
+        """Returns the answer to a command, counting it in the poll."""
+        message, told = await self.answer(cmd, args)
+        self._count(told)
+        return message
 
-        try:
-            tztime = await api.get_time_at(tz, self.session)
-        except api.APIError as e:
-            # Answer with error message
-            logger.error(f"Couldn't retrieve time at {tz}: {str(e)}")
-            return str(e)
-        else:
-            await poll.increment_popularity_of(tz)
-            return self._format_time(tztime)
+    async def _timeat_cmd(self, *names: str) -> str:
+        """Implements the `!timeat <tzinfo> [<tzinfo>...]` command."""
+        message, told = await self._timeat_answer(*names)
+        self._count(told)
+        return message
+
+    def _count(self, timezones: List[str]) -> None:
+        with metrics.COMMAND_LATENCY.time(stage="poll"), profiling.tracer.span(
+            "poll", timezones=timezones
+        ):
+            for tz in timezones:
+                self.poll.increment_popularity_of(tz)
+
+    async def _timeat_answer(self, *names: str) -> Tuple[str, List[str]]:
+        """Returns the answer to `!timeat` and the timezones it told the time at.
+
+        Every timezone not answered within the current minute is looked
+        up concurrently, and the times at all of them are answered in a
+        single message.
+        """
+        with metrics.COMMAND_LATENCY.time(stage="alias"):
+            # If a timezone is an alias, use the full timezone name
+            labels = {}
+            for name in names:
+                labels.setdefault(self.aliases.resolve(name) or name, name)
+
+        answers = {tz: self.responses.get(tz) for tz in labels}
+        missing = [tz for tz, answer in answers.items() if answer is None]
+        failed = set()
+
+        if missing:
+            deadline = asyncio.get_running_loop().time() + settings.COMMAND_DEADLINE
+            with metrics.COMMAND_LATENCY.time(stage="api"):
+                tztimes = await api.get_times_at(
+                    missing, self.session, self.offsets, deadline
+                )
+
+            for tz, tztime in tztimes.items():
+                if isinstance(tztime, api.APIError):
+                    # Answer with error message
+                    logger.error("Couldn't retrieve time at %s: %s", tz, tztime)
+                    answers[tz] = str(tztime)
+                    failed.add(tz)
+                else:
+                    answers[tz] = self._format_time(tztime)
+                    self.responses.put(tz, answers[tz], tztime)
+
+        told = [tz for tz in answers if tz not in failed]
+        if len(answers) == 1:
+            return next(iter(answers.values())), told
+        return " | ".join(f"{labels[tz]}: {a}" for tz, a in answers.items()), told
+
+    def _split_timezones(self, args: List[str]) -> List[str]:
+        """Groups the arguments of `!timeat` into timezone names.
+
+        Up to `settings.TIMEAT_MAX_ZONES` names are taken.
+        """
+        return self.aliases.split(args, settings.TIMEAT_MAX_ZONES)
 
     def _format_time(self, tztime: datetime) -> str:
         return tztime.strftime("%-d %b %Y %H:%M")
 
-    async def _timepopularity_cmd(self, tz_or_prefix):
-        """Implements the `!timepopularity <tzinfo_or_prefix>` command."""
-        return str(await poll.get_popularity_of(tz_or_prefix))
-
-    def _load_aliases(self) -> Dict[str, str]:
-        """Loads the aliases map from the pre-generated JSON file."""
-        with pkg_resources.path(__package__, "aliases.json") as path:
-            if not path.exists():
-                logger.warning("aliases.json was not found")
-                return {}
-            with path.open() as f:
-                return json.load(f)
+    async def _timepopularity_cmd(self, tz_or_prefix, *options):
+        """Implements the `!timepopularity <tzinfo_or_prefix>` command.
+
+        Also `!timepopularity <tzinfo_or_prefix> hour|day`, counting only
+        the requests within that window, and `!timepopularity
+        <tzinfo_or_prefix> top [<N>]`, answering the most requested
+        timezones under the prefix.
+        """
+        if not options:
+            return str(self.poll.get_popularity_of(tz_or_prefix))
+
+        if len(options) == 1 and options[0] in settings.POPULARITY_WINDOWS:
+            return str(self.poll.get_popularity_of(tz_or_prefix, options[0]))
+
+        if options[0] == "top" and (len(options) == 1 or options[1].isdigit()):
+            amount = settings.POPULARITY_TOP_DEFAULT
+            if len(options) == 2:
+                amount = min(int(options[1]), settings.POPULARITY_TOP_MAX)
+            top = self.poll.get_top_of(tz_or_prefix, amount)
+            return " | ".join(f"{tz}: {count}" for tz, count in top) or "0"
+
+        return None
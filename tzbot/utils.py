@@ -1,10 +1,8 @@
 import asyncio
-import importlib.resources as pkg_resources
 import json
 import re
 
-from aiohttp import ClientSession
-
+from . import aliases as alias_index
 from . import api_client as api
 
 
@@ -23,13 +21,19 @@ def tz_prefixes(timezone: str) -> str:
 
 
 async def generate_aliases() -> None:
-    """Generates the aliases JSON file."""
+    """Generates the aliases JSON file and the index used for lookups."""
+    import importlib.resources as pkg_resources
+
+    from aiohttp import ClientSession
+
     # Retrieve all available timezones
+    await api.http_cache.open()
     async with ClientSession() as session:
         try:
             timezones = await api.get_timezones(session)
         except api.APIError:
             timezones = []
+    await api.http_cache.close()
 
     # Map each suffix with its timezone
     aliases = {tz.split("/")[-1]: tz for tz in timezones}
@@ -42,3 +46,9 @@ async def generate_aliases() -> None:
     with pkg_resources.path(__package__, "aliases.json") as path:
         with path.open("w") as f:
             f.write(json.dumps(aliases, indent=2))
+
+    # Dump the index compactly, it's only meant to be loaded
+    index = alias_index.build_index(aliases)
+    with pkg_resources.path(__package__, alias_index.INDEX_FILENAME) as path:
+        with path.open("w") as f:
+            f.write(json.dumps(index, separators=(",", ":")))
@@ -0,0 +1,57 @@
+import time
+
+from typing import Dict, Iterable, List
+
+
+class SlidingWindow:
+    r"""Counts what happened per key within the last `span` seconds.
+
+    Counts are kept in a ring of `buckets` buckets of `span / buckets`
+    seconds each, along with their totals per key. Adding and counting
+    take constant time per key, and counts age out a whole bucket at a
+    time, so the totals cover between `span` minus a bucket and `span`
+    seconds.
+
+    Arguments:
+
+        span -- Seconds covered by the window.
+
+        buckets -- Number of buckets the window is split into.
+    """
+
+    __slots__ = ("width", "buckets", "totals", "current")
+
+    def __init__(self, span: float, buckets: int) -> None:
+        self.width = span / buckets
+        self.buckets: List[Dict[str, int]] = [{} for _ in range(buckets)]
+        self.totals: Dict[str, int] = {}
+        self.current = int(time.monotonic() // self.width)
+
+    def add(self, keys: Iterable[str], amount: int = 1) -> None:
+        """Adds amount to the count of every key."""
+        self._advance()
+        bucket, totals = self.buckets[self.current % len(self.buckets)], self.totals
+        for key in keys:
+            bucket[key] = bucket.get(key, 0) + amount
+            totals[key] = totals.get(key, 0) + amount
+
+    def count(self, key: str) -> int:
+        self._advance()
+        return self.totals.get(key, 0)
+
+    def _advance(self) -> None:
+        now = int(time.monotonic() // self.width)
+        if now == self.current:
+            return
+
+        # Empty the buckets reused since, at most the whole ring
+        last = min(now, self.current + len(self.buckets))
+        for index in range(self.current + 1, last + 1):
+            bucket = self.buckets[index % len(self.buckets)]
+            for key, count in bucket.items():
+                if self.totals[key] == count:
+                    del self.totals[key]
+                else:
+                    self.totals[key] -= count
+            bucket.clear()
+        self.current = now